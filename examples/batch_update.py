@@ -0,0 +1,39 @@
+from pathlib import Path
+
+from metadata_manager import Dataset
+from metadata_manager import run_batch
+
+
+def count_subjects(dataset):
+    """
+    A user function called with each loaded dataset. It needs to be defined at the module level
+    """
+    return len(dataset.query("subjects"))
+
+
+def print_progress(completed, total, result):
+    print(str(completed) + "/" + str(total) + " " + result["path"] + " " + result["status"])
+
+
+def main(cfg, test=False):
+    dataset = Dataset()
+
+    # Save a few datasets from the SPARC template
+    archive_dir = Path(__file__).parent.resolve() / "./tmp/archive"
+    for name in ["dataset_1", "dataset_2", "dataset_3"]:
+        dataset.save_template(archive_dir / name, version="2.0.0")
+
+    # Apply the same edits to all the datasets
+    edits = [
+        {"action": "set_field", "category": "dataset_description", "row_index": 5, "header": "Value", "value": "Test Project"},
+        {"action": "append", "category": "subjects", "row": {"subject id": "sub-1", "species": "human"}}
+    ]
+    summary = run_batch(str(archive_dir / "*"), function=count_subjects, edits=edits, progress=print_progress)
+
+    print("Updated: " + str(summary["succeeded"]) + "/" + str(summary["total"]))
+    for result in summary["results"]:
+        print(result["path"] + ": " + str(result["result"]) + " subject(s)")
+
+
+if __name__ == '__main__':
+    main(None, test=False)
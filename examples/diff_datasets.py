@@ -0,0 +1,44 @@
+import json
+import shutil
+from pathlib import Path
+
+from metadata_manager import Dataset
+from metadata_manager import ChangeSet, diff_datasets
+
+
+def main(cfg, test=False):
+    dataset = Dataset()
+
+    # Save two snapshots of a dataset
+    old_dir = Path(__file__).parent.resolve() / "./tmp/snapshots/old"
+    new_dir = Path(__file__).parent.resolve() / "./tmp/snapshots/new"
+    dataset.save_template(old_dir, version="2.0.0")
+    shutil.copytree(str(old_dir), str(new_dir))
+
+    # Update the new snapshot
+    dataset.load_dataset(new_dir)
+    dataset.set_field(category="dataset_description", row_index=5, header="Value", value="Test Project")
+    dataset.append(category="subjects", row={"subject id": "sub-1", "species": "human"})
+    dataset.save(new_dir)
+
+    # Compare the snapshots. Use content=True to compare the files by content hash instead of modification time
+    change_set = diff_datasets(old_dir, new_dir, content=True)
+    print(change_set.summary())
+
+    # Store the change set as JSON, and load it back
+    change_set_path = Path(__file__).parent.resolve() / "./tmp/snapshots/changes.json"
+    with open(str(change_set_path), "w") as f:
+        json.dump(change_set.to_dict(), f, indent=2)
+    with open(str(change_set_path)) as f:
+        change_set = ChangeSet.from_dict(json.load(f))
+
+    # Apply the changes to the old snapshot
+    old_dataset = Dataset()
+    old_dataset.load_dataset(old_dir)
+    change_set.apply(old_dataset)
+    change_set.apply_files(old_dir)
+    old_dataset.save(old_dir)
+
+
+if __name__ == '__main__':
+    main(None, test=False)
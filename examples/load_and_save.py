@@ -1,6 +1,7 @@
 from metadata_manager import Dataset
 
-if __name__ == '__main__':
+
+def main(cfg, test=False):
     dataset = Dataset()
 
     # Load the SPARC template dataset. source from https://github.com/SciCrunch/sparc-curation
@@ -10,3 +11,6 @@ if __name__ == '__main__':
     # Save the template dataset
     dataset.save(save_dir="./tmp/template/")
 
+
+if __name__ == '__main__':
+    main(None, test=False)
@@ -0,0 +1,31 @@
+from pathlib import Path
+
+from metadata_manager import Dataset
+from metadata_manager import migrate_dataset, migrate_datasets
+
+
+def main(cfg, test=False):
+    dataset = Dataset()
+
+    # Save a dataset in the version 1.2.3 SPARC template
+    dataset_dir = Path(__file__).parent.resolve() / "./tmp/legacy/dataset_1"
+    dataset.save_template(dataset_dir, version="1.2.3")
+
+    # Migrate a single dataset to the version 2.0.0 SPARC template
+    report = migrate_dataset(dataset_dir, Path(__file__).parent.resolve() / "./tmp/migrated_single/dataset_1",
+                             from_version="1.2.3", to_version="2.0.0")
+    print(report["counts"])
+    # the values without an equivalent in the version 2.0.0 template
+    print(report["dropped"])
+
+    # Migrate many datasets in a process pool. Each dataset is saved to "./tmp/migrated/<dataset folder name>"
+    # The datasets can be given as a list or a glob pattern
+    dataset_dirs = str(Path(__file__).parent.resolve() / "./tmp/legacy/*")
+    summary = migrate_datasets(dataset_dirs, Path(__file__).parent.resolve() / "./tmp/migrated",
+                               from_version="1.2.3", to_version="2.0.0")
+    print("Migrated: " + str(summary["succeeded"]) + "/" + str(summary["total"]))
+    print(summary["failures"])
+
+
+if __name__ == '__main__':
+    main(None, test=False)
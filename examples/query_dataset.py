@@ -0,0 +1,24 @@
+from pathlib import Path
+
+from metadata_manager import Dataset
+
+
+def main(cfg, test=False):
+    dataset = Dataset()
+
+    # Set dataset path. If the template dataset is already saved in "./tmp/template". you can then do:
+    # dataset_dir = "/path/to/dataset/dir"
+    dataset_dir = Path(__file__).parent.resolve() / "./tmp/template"
+    dataset.set_dataset_path(dataset_dir)
+
+    # All samples for human subjects older than 50.
+    # "subjects" and "samples" are joined on the "subject id" column.
+    # Only the required columns and the matching rows are read from the metadata files
+    samples = dataset.query(categories=["subjects", "samples"],
+                            columns=["sample id", "subject id", "age", "species"],
+                            filters=[("age", ">", 50), ("species", "==", "human")])
+    print(samples)
+
+
+if __name__ == '__main__':
+    main(None, test=False)
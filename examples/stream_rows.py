@@ -0,0 +1,32 @@
+from pathlib import Path
+
+from metadata_manager import Dataset
+
+
+def main(cfg, test=False):
+    dataset = Dataset()
+
+    # Set dataset path. If the template dataset is already saved in "./tmp/template". you can then do:
+    # dataset_dir = "/path/to/dataset/dir"
+    dataset_dir = Path(__file__).parent.resolve() / "./tmp/template"
+    dataset.set_dataset_path(dataset_dir)
+
+    # Stream the rows of the "subjects" metadata file without loading the whole workbook
+    for row in dataset.iter_rows(category="subjects", columns=["subject id", "species"]):
+        print(row)
+
+    # Or stream the rows in DataFrame chunks
+    for chunk in dataset.iter_rows(category="manifest", chunksize=1000):
+        print(chunk.shape)
+
+    # Transform a large metadata file with constant memory
+    def update_file_type(chunk):
+        chunk["file type"] = chunk["file type"].fillna("n/a")
+        return chunk
+
+    chunks = (update_file_type(chunk) for chunk in dataset.iter_rows(category="manifest", chunksize=1000))
+    dataset.write_rows(category="manifest", rows=chunks, save_dir=dataset_dir)
+
+
+if __name__ == '__main__':
+    main(None, test=False)
@@ -1,2 +1,7 @@
 from metadata_manager.core.dataset import Dataset
 from metadata_manager.utils.metadata_extraction import extract_metadata_from_dcm
+from metadata_manager.core.migration import migrate_dataset, migrate_datasets
+from metadata_manager.core.batch import run_batch
+from metadata_manager.core.diff import ChangeSet, diff_datasets
+from metadata_manager.core.watch import DatasetWatcher
+from metadata_manager.core.async_dataset import AsyncDataset, extract_metadata
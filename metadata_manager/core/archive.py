@@ -0,0 +1,399 @@
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+import zipfile
+from collections import namedtuple
+from pathlib import Path, PurePosixPath, PureWindowsPath
+
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz")
+COPY_BUFFER_SIZE = 1024 * 1024
+
+# A file or folder in an archive. The name is relative to the dataset root, in posix format
+ArchiveEntry = namedtuple("ArchiveEntry", ["name", "is_dir", "size", "mtime", "raw"])
+
+
+def is_archive(path):
+    """
+    Check whether a path is a dataset archive, based on its suffix
+
+    :param path: path to the dataset
+    :type path: string
+    :return: True if the path is a .zip, .tar, .tar.gz or .tgz file
+    :rtype: bool
+    """
+    return str(path).lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def _normalise(name):
+    """
+    Normalise the name of an archive member
+
+    :param name: member name
+    :type name: string
+    :return: member name without the leading "./" and the trailing "/"
+    :rtype: string
+    """
+    name = name.replace("\\", "/")
+    while name.startswith("./"):
+        name = name[2:]
+
+    return name.strip("/")
+
+
+def _is_safe(name):
+    """
+    Check whether the name of an archive member stays in the folder the archive is extracted to
+
+    :param name: member name, as stored in the archive
+    :type name: string
+    :return: False for absolute names (e.g. "/etc/passwd" or "C:/file") and names with ".." parts
+    :rtype: bool
+    """
+    name = name.replace("\\", "/")
+    if name.startswith("/") or PureWindowsPath(name).drive:
+        return False
+
+    return ".." not in PurePosixPath(name).parts
+
+
+class ArchiveReader(object):
+    """
+    Read a dataset from a zip or tar archive without extracting it.
+    If all the files are in a single top level folder, the folder is used as the dataset root.
+    """
+
+    def __init__(self, path):
+        self._path = Path(path)
+        if not self._path.is_file():
+            msg = "Archive not found: " + str(self._path)
+            raise ValueError(msg)
+
+        if zipfile.is_zipfile(str(self._path)):
+            self._zip = zipfile.ZipFile(str(self._path))
+            self._tar = None
+        else:
+            self._zip = None
+            self._tar = tarfile.open(str(self._path), mode="r:*")
+
+        self._entries = self._read_entries()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Close the archive
+        """
+        if self._zip is not None:
+            self._zip.close()
+        if self._tar is not None:
+            self._tar.close()
+
+    def _read_entries(self):
+        """
+        List the archive members relative to the dataset root.
+        Members with an absolute name or a ".." part are skipped, so they can not be written outside the dataset
+
+        :return: archive entries
+        :rtype: list
+        """
+        entries = list()
+        if self._zip is not None:
+            for info in self._zip.infolist():
+                if not _is_safe(info.filename):
+                    continue
+                mtime = time.mktime(info.date_time + (0, 0, -1))
+                entries.append(ArchiveEntry(_normalise(info.filename), info.is_dir(), info.file_size, mtime, info))
+        else:
+            for info in self._tar.getmembers():
+                if (info.isdir() or info.isfile()) and _is_safe(info.name):
+                    entries.append(ArchiveEntry(_normalise(info.name), info.isdir(), info.size, info.mtime, info))
+        entries = [entry for entry in entries if entry.name]
+
+        # use a single top level folder as the dataset root
+        tops = set(PurePosixPath(entry.name).parts[0] for entry in entries)
+        if len(tops) == 1:
+            top = tops.pop()
+            if all(entry.is_dir for entry in entries if entry.name == top):
+                prefix = top + "/"
+                entries = [entry._replace(name=entry.name[len(prefix):]) for entry in entries
+                           if entry.name.startswith(prefix)]
+
+        return entries
+
+    def entries(self):
+        """
+        List the files and folders in the archive, in archive order
+
+        :return: archive entries
+        :rtype: list
+        """
+        return list(self._entries)
+
+    def top_level(self):
+        """
+        List the top level files and folders of the dataset
+
+        :return: {name: is_dir}
+        :rtype: dict
+        """
+        top_level = dict()
+        for entry in self._entries:
+            parts = PurePosixPath(entry.name).parts
+            top_level[parts[0]] = top_level.get(parts[0], False) or entry.is_dir or len(parts) > 1
+
+        return top_level
+
+    def open(self, entry):
+        """
+        Open an archive member as a binary stream. The member is decompressed while it is read
+
+        :param entry: archive entry, or the name of the member relative to the dataset root
+        :type entry: ArchiveEntry or string
+        :return: file object
+        :rtype: file
+        """
+        if not isinstance(entry, ArchiveEntry):
+            matches = [item for item in self._entries if item.name == entry and not item.is_dir]
+            if not matches:
+                msg = "File not found in archive " + str(self._path) + ": " + str(entry)
+                raise ValueError(msg)
+            entry = matches[0]
+
+        if self._zip is not None:
+            return self._zip.open(entry.raw)
+
+        return self._tar.extractfile(entry.raw)
+
+    def read(self, entry):
+        """
+        Read an archive member
+
+        :param entry: archive entry, or the name of the member relative to the dataset root
+        :type entry: ArchiveEntry or string
+        :return: content of the member
+        :rtype: bytes
+        """
+        with self.open(entry) as f:
+            return f.read()
+
+
+class ArchiveMember(object):
+    """
+    A top level file or folder of a dataset loaded from an archive
+    """
+
+    def __init__(self, archive_path, name, is_dir=False):
+        self.archive_path = Path(archive_path)
+        self.name = name
+        self.is_dir = is_dir
+
+    def __repr__(self):
+        return "ArchiveMember(" + str(self.archive_path) + ", " + self.name + ")"
+
+    def contains(self, name):
+        """
+        Check whether an archive entry belongs to this member
+
+        :param name: name of the entry relative to the dataset root
+        :type name: string
+        :return: True if the entry is this member, or a file in this folder
+        :rtype: bool
+        """
+        return name == self.name or name.startswith(self.name + "/")
+
+
+class ArchiveWriter(object):
+    """
+    Write a dataset to a zip or tar archive. The archive is written to a temporary file,
+    which replaces the output file only when the archive is complete.
+    """
+
+    def __init__(self, path):
+        self._path = Path(path)
+        if not self._path.parent.is_dir():
+            self._path.parent.mkdir(parents=True)
+
+        fd, self._tmp_path = tempfile.mkstemp(prefix="." + self._path.name + ".", dir=str(self._path.parent))
+        os.close(fd)
+
+        name = self._path.name.lower()
+        if name.endswith(".zip"):
+            self._zip = zipfile.ZipFile(self._tmp_path, mode="w", compression=zipfile.ZIP_DEFLATED, allowZip64=True)
+            self._tar = None
+        else:
+            mode = "w:gz" if name.endswith((".tar.gz", ".tgz")) else "w"
+            self._zip = None
+            self._tar = tarfile.open(self._tmp_path, mode=mode)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def add_stream(self, name, fileobj, size, mtime=None):
+        """
+        Add a file to the archive from a binary stream, without buffering the whole file
+
+        :param name: name of the file in the archive
+        :type name: string
+        :param fileobj: binary stream
+        :type fileobj: file
+        :param size: size of the file in bytes
+        :type size: int
+        :param mtime: (optional) modification time. Defaults to now
+        :type mtime: float
+        """
+        mtime = time.time() if mtime is None else mtime
+        if self._zip is not None:
+            info = zipfile.ZipInfo(name, date_time=time.localtime(mtime)[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.external_attr = 0o644 << 16
+            with self._zip.open(info, mode="w", force_zip64=True) as f:
+                shutil.copyfileobj(fileobj, f, COPY_BUFFER_SIZE)
+        else:
+            info = tarfile.TarInfo(name)
+            info.size = size
+            info.mtime = mtime
+            self._tar.addfile(info, fileobj)
+
+    def add_bytes(self, name, data):
+        """
+        Add a file to the archive from memory
+
+        :param name: name of the file in the archive
+        :type name: string
+        :param data: content of the file
+        :type data: bytes
+        """
+        if self._zip is not None:
+            info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.external_attr = 0o644 << 16
+            self._zip.writestr(info, data)
+        else:
+            self.add_stream(name, io.BytesIO(data), len(data))
+
+    def add_path(self, path, name):
+        """
+        Add a file or a folder from disk to the archive
+
+        :param path: path to the file or folder
+        :type path: string
+        :param name: name of the file or folder in the archive
+        :type name: string
+        """
+        path = Path(path)
+        if self._zip is not None:
+            if path.is_dir():
+                for sub_path in sorted(path.rglob("*")):
+                    if sub_path.is_file():
+                        self._zip.write(str(sub_path), name + "/" + sub_path.relative_to(path).as_posix())
+            else:
+                self._zip.write(str(path), name)
+        else:
+            self._tar.add(str(path), arcname=name)
+
+    def close(self):
+        """
+        Finish the archive and move it to the output path
+        """
+        if self._zip is not None:
+            self._zip.close()
+        else:
+            self._tar.close()
+
+        # mkstemp creates the file readable by the owner only. keep the mode of the replaced archive, or apply the umask
+        if self._path.exists():
+            mode = self._path.stat().st_mode & 0o777
+        else:
+            umask = os.umask(0)
+            os.umask(umask)
+            mode = 0o666 & ~umask
+        os.chmod(self._tmp_path, mode)
+        os.replace(self._tmp_path, str(self._path))
+
+    def abort(self):
+        """
+        Discard the archive
+        """
+        try:
+            if self._zip is not None:
+                self._zip.close()
+            else:
+                self._tar.close()
+        finally:
+            if os.path.exists(self._tmp_path):
+                os.remove(self._tmp_path)
+
+
+def _is_within(path, directory):
+    """
+    Check whether a path resolves to a location in a directory
+
+    :param path: path to check
+    :type path: Path
+    :param directory: path to the directory
+    :type directory: string
+    :return: True if the path is in the directory
+    :rtype: bool
+    """
+    try:
+        Path(path).resolve().relative_to(Path(directory).resolve())
+    except ValueError:
+        return False
+
+    return True
+
+
+def copy_members(members, writer=None, save_dir=None):
+    """
+    Copy dataset members from their archives to another archive or to a folder.
+    Each source archive is read once, in archive order, and the files are streamed without temporary files
+
+    :param members: top level files and folders of datasets loaded from archives
+    :type members: list
+    :param writer: (optional) the output archive
+    :type writer: ArchiveWriter
+    :param save_dir: (optional) the output folder
+    :type save_dir: string
+    """
+    archives = dict()
+    for member in members:
+        archives.setdefault(member.archive_path, list()).append(member)
+
+    for archive_path, archive_members in archives.items():
+        with ArchiveReader(archive_path) as reader:
+            for entry in reader.entries():
+                if not any(member.contains(entry.name) for member in archive_members):
+                    continue
+
+                if writer is not None:
+                    if not entry.is_dir:
+                        with reader.open(entry) as f:
+                            writer.add_stream(entry.name, f, entry.size, entry.mtime)
+                    continue
+
+                path = Path(save_dir) / entry.name
+                if not _is_within(path, save_dir):
+                    msg = "Archive member outside of the output folder: " + entry.name
+                    raise ValueError(msg)
+                if entry.is_dir:
+                    path.mkdir(parents=True, exist_ok=True)
+                    continue
+                path.parent.mkdir(parents=True, exist_ok=True)
+                # replace an existing file rather than writing through it, in case it is hard linked
+                if os.path.lexists(str(path)):
+                    os.remove(str(path))
+                with reader.open(entry) as f, open(str(path), "wb") as out:
+                    shutil.copyfileobj(f, out, COPY_BUFFER_SIZE)
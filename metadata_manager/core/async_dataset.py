@@ -0,0 +1,210 @@
+import asyncio
+import functools
+import threading
+
+from metadata_manager.core.dataset import Dataset
+from metadata_manager.utils.metadata_extraction import extract_metadata_from_dcm
+
+
+async def _run_in_executor(executor, semaphore, function, *args, **kwargs):
+    """
+    Run a blocking function in an executor, waiting for the semaphore first
+
+    :param executor: the executor, or None for the default executor of the event loop
+    :type executor: concurrent.futures.Executor
+    :param semaphore: (optional) semaphore which limits the number of calls in flight
+    :type semaphore: asyncio.Semaphore
+    :param function: the blocking function
+    :type function: function
+    :return: the return value of the function
+    :rtype: object
+    """
+    loop = asyncio.get_event_loop()
+    if semaphore is None:
+        return await loop.run_in_executor(executor, functools.partial(function, *args, **kwargs))
+
+    async with semaphore:
+        return await loop.run_in_executor(executor, functools.partial(function, *args, **kwargs))
+
+
+async def extract_metadata(path, target_tags=None, executor=None, semaphore=None):
+    """
+    Extract metadata from dicom without blocking the event loop. See extract_metadata_from_dcm
+
+    :param path: path to the dicom image. It can be a single file or a folder
+    :type path: string
+    :param target_tags: optional. if provided, will only extract the metadata for the provided tags.
+                        This needs to be in the dictionary format with dicom key and tag pair, e.g. {'name': '0x10, 0x10'}
+    :type target_tags: dict
+    :param executor: (optional) the executor which reads the dicom file, e.g. a ProcessPoolExecutor for many files.
+                     Defaults to the default executor of the event loop
+    :type executor: concurrent.futures.Executor
+    :param semaphore: (optional) semaphore shared by the calls to limit the number of extractions in flight
+    :type semaphore: asyncio.Semaphore
+    :return: metadata from the dicom file
+    :rtype: dict
+    """
+    return await _run_in_executor(executor, semaphore, extract_metadata_from_dcm, path, target_tags)
+
+
+class AsyncDataset(object):
+    """
+    Asyncio facade of Dataset. The file I/O and the parsing run in an executor so they do not block the event loop.
+
+    The calls on an AsyncDataset run one at a time, in the order they are made, as a Dataset can not be used by
+    several threads at once. The calls on different AsyncDatasets run concurrently.
+    Share an asyncio.Semaphore between AsyncDatasets to limit the number of calls in flight.
+
+    A cancelled call which has not started yet is skipped. A call which already runs in the executor can not be
+    interrupted: the cancelled coroutine waits for it to finish, so the next call does not use the dataset at the same time.
+    """
+
+    def __init__(self, dataset=None, executor=None, semaphore=None):
+        """
+        :param dataset: (optional) the dataset to wrap. Defaults to a new Dataset
+        :type dataset: Dataset
+        :param executor: (optional) the executor running the Dataset calls. It needs to run them in the current process,
+                         e.g. a ThreadPoolExecutor. Defaults to the default executor of the event loop
+        :type executor: concurrent.futures.Executor
+        :param semaphore: (optional) semaphore shared by several AsyncDatasets to limit the number of calls in flight
+        :type semaphore: asyncio.Semaphore
+        """
+        self.dataset = Dataset() if dataset is None else dataset
+        self._executor = executor
+        self._semaphore = semaphore
+        # created in the event loop on the first call
+        self._lock = None
+
+    async def _run(self, function, *args, **kwargs):
+        """
+        Run a blocking Dataset call in the executor, after the previous calls on this dataset
+
+        :param function: the blocking function
+        :type function: function
+        :return: the return value of the function
+        :rtype: object
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        cancelled = threading.Event()
+
+        def call():
+            if cancelled.is_set():
+                return None
+            return function(*args, **kwargs)
+
+        async with self._lock:
+            future = asyncio.ensure_future(_run_in_executor(self._executor, self._semaphore, call))
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                cancelled.set()
+                if not future.done():
+                    await asyncio.wait([future])
+                raise
+
+    async def call(self, method, *args, **kwargs):
+        """
+        Call any Dataset method in the executor, e.g. await dataset.call("list_elements", "subjects")
+
+        :param method: name of the Dataset method
+        :type method: string
+        :return: the return value of the method
+        :rtype: object
+        """
+        return await self._run(getattr(self.dataset, method), *args, **kwargs)
+
+    async def load_dataset(self, dataset_path=None, from_template=False, version=None, compact=False):
+        """
+        Load the input dataset into a dictionary. See Dataset.load_dataset
+
+        :param dataset_path: path to the dataset directory, or to a .zip/.tar/.tar.gz archive of the dataset
+        :type dataset_path: string
+        :param from_template: whether to load the dataset from a SPARC template
+        :type from_template: bool
+        :param version: dataset version
+        :type version: string
+        :param compact: (optional) whether to keep the metadata in the compact representation
+        :type compact: bool
+        :return: loaded dataset
+        :rtype: dict
+        """
+        return await self._run(self.dataset.load_dataset, dataset_path=dataset_path, from_template=from_template,
+                               version=version, compact=compact)
+
+    async def load_metadata(self, path, compact=False):
+        """
+        Load & update a single metadata. See Dataset.load_metadata
+
+        :param path: path to the metadata file
+        :type path: string
+        :param compact: (optional) whether to keep the metadata in the compact representation
+        :type compact: bool
+        :return: metadata
+        :rtype: Pandas.DataFrame
+        """
+        return await self._run(self.dataset.load_metadata, path, compact=compact)
+
+    async def save(self, save_dir, remove_empty=False, atomic=False, max_workers=None):
+        """
+        Save dataset. See Dataset.save
+
+        :param save_dir: path to the dest dir, or to a .zip/.tar/.tar.gz archive
+        :type save_dir: string
+        :param remove_empty: (optional) If True, remove rows which do not have values in the "Value" field
+        :type remove_empty: bool
+        :param atomic: (optional) If True, write the metadata files in parallel and replace the dest dir atomically
+        :type atomic: bool
+        :param max_workers: (optional) number of worker processes used when atomic is True
+        :type max_workers: int
+        """
+        return await self._run(self.dataset.save, save_dir, remove_empty=remove_empty, atomic=atomic,
+                               max_workers=max_workers)
+
+    async def set_field(self, category, row_index, header, value):
+        """
+        Set single field by row idx/name and column name (the header). See Dataset.set_field
+
+        :param category: metadata category
+        :type category: string
+        :param row_index: row index in Excel. Excel index starts from 1 where index 1 is the header row
+        :type row_index: int
+        :param header: column name. the header is the first row
+        :type header: string
+        :param value: field value
+        :type value: string
+        :return: updated dataset
+        :rtype: dict
+        """
+        return await self._run(self.dataset.set_field, category, row_index, header, value)
+
+    async def append(self, category, row):
+        """
+        Append a row to a metadata file. See Dataset.append
+
+        :param category: metadata category
+        :type category: string
+        :param row: a row to be appended
+        :type row: dic
+        :return: updated dataset
+        :rtype: dict
+        """
+        return await self._run(self.dataset.append, category, row)
+
+    async def query(self, categories, columns=None, filters=None, how="inner"):
+        """
+        Query and join the metadata categories. See Dataset.query
+
+        :param categories: metadata categories to join, e.g. ["subjects", "samples"]
+        :type categories: list
+        :param columns: (optional) the columns to return
+        :type columns: list
+        :param filters: (optional) a list of (column, operator, value) filters
+        :type filters: list
+        :param how: (optional) type of join: "inner", "left", "right" or "outer"
+        :type how: string
+        :return: the query result
+        :rtype: Pandas.DataFrame
+        """
+        return await self._run(self.dataset.query, categories, columns=columns, filters=filters, how=how)
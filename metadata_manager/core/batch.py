@@ -0,0 +1,160 @@
+import glob
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from metadata_manager.core.dataset import Dataset
+
+EDIT_ACTIONS = ("set_field", "append")
+
+
+def find_datasets(dataset_dirs):
+    """
+    Find the dataset directories
+
+    :param dataset_dirs: a list of dataset directories, or a glob pattern e.g. "/archive/*/dataset"
+    :type dataset_dirs: list or string
+    :return: paths to the dataset directories
+    :rtype: list
+    """
+    if isinstance(dataset_dirs, (str, Path)):
+        dataset_dirs = sorted(path for path in glob.glob(str(dataset_dirs)) if Path(path).is_dir())
+
+    return [str(path) for path in dataset_dirs]
+
+
+def _check_edit(edit):
+    """
+    Check a declarative edit
+
+    :param edit: a declarative edit, e.g. {"action": "append", "category": "subjects", "row": {"subject id": "sub-1"}}
+    :type edit: dict
+    """
+    if edit.get("action") not in EDIT_ACTIONS:
+        msg = "Unknown edit action: " + str(edit.get("action")) + ". Use one of: " + ", ".join(EDIT_ACTIONS)
+        raise ValueError(msg)
+
+
+def run_tasks(worker, tasks, max_workers=None, progress=None):
+    """
+    Run tasks in a process pool and summarise the results.
+    Each worker call should return a result dictionary with the "path" and "status" keys ("succeeded" or "failed").
+    The first argument of each task is its path. A task whose worker call could not complete, e.g. because the worker
+    process crashed or the arguments could not be sent to it, is recorded as failed.
+
+    :param worker: a function which processes a single task. It needs to be defined at the module level
+    :type worker: function
+    :param tasks: the arguments of each worker call
+    :type tasks: list
+    :param max_workers: (optional) number of worker processes. Defaults to the number of CPUs
+    :type max_workers: int
+    :param progress: (optional) a function called with (completed, total, result) each time a task finishes
+    :type progress: function
+    :return: summary with the "total", "succeeded", "failed", "duration", "failures" ({path: error}) and "results" keys
+    :rtype: dict
+    """
+    start = time.time()
+    results = list()
+
+    if tasks:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(worker, *task): str(task[0]) for task in tasks}
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {"path": futures[future], "status": "failed", "result": None, "error": str(e),
+                              "traceback": "".join(traceback.format_exception(type(e), e, e.__traceback__)),
+                              "duration": None}
+                results.append(result)
+                if progress:
+                    progress(len(results), len(tasks), result)
+
+    failures = {result["path"]: result["error"] for result in results if result["status"] == "failed"}
+    summary = {
+        "total": len(tasks),
+        "succeeded": len(results) - len(failures),
+        "failed": len(failures),
+        "duration": time.time() - start,
+        "failures": failures,
+        "results": sorted(results, key=lambda result: result["path"]),
+    }
+
+    return summary
+
+
+def _process_dataset(path, function, edits, save, version):
+    """
+    Load, update and save a single dataset in a worker process
+
+    :param path: path to the dataset directory
+    :type path: string
+    :param function: (optional) a function called with the loaded dataset
+    :type function: function
+    :param edits: (optional) a list of declarative edits
+    :type edits: list
+    :param save: whether to save the dataset
+    :type save: bool
+    :param version: (optional) dataset version
+    :type version: string
+    :return: result with the "path", "status", "result", "error" and "duration" keys
+    :rtype: dict
+    """
+    start = time.time()
+    result = {"path": path, "status": "succeeded", "result": None, "error": None}
+    try:
+        dataset = Dataset()
+        dataset.load_dataset(path, version=version)
+
+        for edit in edits or list():
+            _check_edit(edit)
+            kwargs = dict(edit)
+            action = kwargs.pop("action")
+            getattr(dataset, action)(**kwargs)
+
+        if function:
+            result["result"] = function(dataset)
+
+        if save:
+            dataset.save(path)
+    except Exception as e:
+        result["status"] = "failed"
+        result["error"] = str(e)
+        result["traceback"] = traceback.format_exc()
+
+    result["duration"] = time.time() - start
+
+    return result
+
+
+def run_batch(dataset_dirs, function=None, edits=None, save=True, version=None, max_workers=None, progress=None):
+    """
+    Load, update and save many datasets in a process pool.
+
+    :param dataset_dirs: a list of dataset directories, or a glob pattern e.g. "/archive/*/dataset"
+    :type dataset_dirs: list or string
+    :param function: (optional) a function called with each loaded dataset. Its return value is stored in the results.
+                     It needs to be defined at the module level so it can be sent to the worker processes
+    :type function: function
+    :param edits: (optional) a list of declarative edits applied to each dataset, e.g.
+                  [{"action": "set_field", "category": "dataset_description", "row_index": 2, "header": "Value", "value": "2.0.0"},
+                   {"action": "append", "category": "subjects", "row": {"subject id": "sub-1"}}]
+    :type edits: list
+    :param save: (optional) whether to save each dataset after the update
+    :type save: bool
+    :param version: (optional) dataset version
+    :type version: string
+    :param max_workers: (optional) number of worker processes. Defaults to the number of CPUs
+    :type max_workers: int
+    :param progress: (optional) a function called with (completed, total, result) each time a dataset is processed
+    :type progress: function
+    :return: summary with the "total", "succeeded", "failed", "duration", "failures" ({path: error}) and "results" keys
+    :rtype: dict
+    """
+    for edit in edits or list():
+        _check_edit(edit)
+
+    tasks = [(path, function, edits, save, version) for path in find_datasets(dataset_dirs)]
+
+    return run_tasks(_process_dataset, tasks, max_workers=max_workers, progress=progress)
@@ -1,5 +1,11 @@
+import io
 import os
 import shutil
+import tempfile
+from collections import OrderedDict
+from contextlib import ExitStack
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from distutils.dir_util import copy_tree
 
@@ -7,11 +13,130 @@ import pandas as pd
 from styleframe import StyleFrame
 from xlrd import XLRDError
 
+from metadata_manager.core.archive import ArchiveMember, ArchiveReader, ArchiveWriter, _is_within, copy_members, is_archive
+from metadata_manager.core.query import PATH_COLUMN, add_path_ids, filter_frame, find_join_key, get_path_id_columns
+from metadata_manager.core.watch import DatasetWatcher
+from metadata_manager.utils.compact import compact_frame, expand_frame, get_columns, prepare_column
+from metadata_manager.utils.streaming import iter_excel_rows, read_excel_header, write_excel_rows
+
+
+@lru_cache(maxsize=None)
+def _read_template(template_path):
+    """
+    Read a template metadata file. Cached so each template is read only once per process,
+    e.g. once per worker process of run_batch instead of once per saved dataset
+
+    :param template_path: path to the template metadata file
+    :type template_path: string
+    :return: the content of the file
+    :rtype: bytes
+    """
+    with open(template_path, "rb") as f:
+        return f.read()
+
+
+def _write_workbook(template_path, data, output=None):
+    """
+    Write metadata using the style of a template metadata file.
+    Defined at the module level so it can run in a worker process
+
+    :param template_path: path to the template metadata file
+    :type template_path: string
+    :param data: metadata
+    :type data: Pandas.DataFrame
+    :param output: (optional) path to the output file, or a binary stream. If None, the content is returned
+    :type output: string
+    :return: the content of the file if output is None
+    :rtype: bytes
+    """
+    buffer = io.BytesIO() if output is None else None
+    sf = StyleFrame.read_excel_as_template(io.BytesIO(_read_template(str(template_path))), data)
+    writer = StyleFrame.ExcelWriter(buffer if output is None else output)
+    sf.to_excel(writer)
+    writer.save()
+
+    return buffer.getvalue() if buffer is not None else None
+
+
+def _link_or_copy(source, target, link=True):
+    """
+    Hard link a file, or copy it if hard links are not supported, e.g. across filesystems.
+    An existing target is removed first, so a file hard linked to it is not changed
+
+    :param source: path to the file
+    :type source: string
+    :param target: path to the link or the copy
+    :type target: string
+    :param link: (optional) If False, always copy the file
+    :type link: bool
+    """
+    if os.path.lexists(str(target)):
+        os.remove(str(target))
+    if link:
+        try:
+            os.link(str(source), str(target))
+            return
+        except OSError:
+            pass
+    shutil.copy2(str(source), str(target))
+
+
+def _copy_tree(source, target, link=False):
+    """
+    Copy (or hard link) the files of a folder into another folder.
+    Like copy_tree(update=1), the existing files which are not older than the source files are kept
+
+    :param source: path to the folder
+    :type source: string
+    :param target: path to the output folder
+    :type target: string
+    :param link: (optional) If True, hard link the files instead of copying them
+    :type link: bool
+    """
+    source = Path(source)
+    target = Path(target)
+    target.mkdir(parents=True, exist_ok=True)
+    for path in sorted(source.rglob("*")):
+        target_path = target / path.relative_to(source)
+        if path.is_dir():
+            target_path.mkdir(parents=True, exist_ok=True)
+            continue
+
+        target_path.parent.mkdir(parents=True, exist_ok=True)
+        if target_path.exists() and target_path.stat().st_mtime >= path.stat().st_mtime:
+            continue
+        _link_or_copy(path, target_path, link=link)
+
+
+class Snapshot(object):
+    """
+    A snapshot of a loaded dataset, created by Dataset.snapshot() and restored by Dataset.restore().
+    The metadata DataFrames are shared with the dataset, which copies a category only when it is changed.
+    """
+
+    def __init__(self, dataset, modified, dataset_path, version):
+        self._dataset = dataset
+        self._modified = modified
+        self._dataset_path = dataset_path
+        self._version = version
+
+    def __repr__(self):
+        return "Snapshot(" + str(self._dataset_path) + ", " + str(len(self._dataset)) + " entries)"
+
+    def get_dataset_path(self):
+        """
+        Return the path to the dataset directory at the time of the snapshot
+        :return: path to the dataset directory
+        :rtype: string
+        """
+        return str(self._dataset_path)
+
 
 class Dataset(object):
     def __init__(self):
         DEFAULT_DATASET_VERSION = "2.0.0"
         EXTENSIONS = [".xlsx"]
+        QUERY_CACHE_SIZE = 32
 
         self._template_version = DEFAULT_DATASET_VERSION
         self._version = DEFAULT_DATASET_VERSION
@@ -24,6 +149,15 @@ class Dataset(object):
         self._dataset = dict()
         self._metadata_extensions = EXTENSIONS
 
+        self._query_cache = OrderedDict()
+        self._query_cache_size = QUERY_CACHE_SIZE
+        # categories with changes not saved to the dataset path yet
+        self._modified = set()
+        # categories whose metadata is shared with a snapshot and needs to be copied before it is changed in place
+        self._shared = set()
+        # the running watchers, which should not reload the files written by save
+        self._watchers = list()
+
     def set_dataset_path(self, path):
         """
         Set the path to the dataset
@@ -63,33 +197,53 @@ class Dataset(object):
         version = version.replace(".", "_")
         self._template_version = version
 
-    def _load(self, dir_path):
+    def _read_metadata(self, path):
+        """
+        Read a metadata file. Empty rows and columns without a header are removed
+
+        :param path: path to the metadata file
+        :type path: string
+        :return: metadata
+        :rtype: Pandas.DataFrame
+        """
+        try:
+            metadata = pd.read_excel(path)
+        except XLRDError:
+            metadata = pd.read_excel(path, engine='openpyxl')
+
+        metadata = metadata.dropna(how="all")
+        metadata = metadata.loc[:, ~metadata.columns.str.contains('^Unnamed')]
+
+        return metadata
+
+    def _load(self, dir_path, compact=False):
         """
         Load the input dataset into a dictionary
 
         :param dir_path: path to the dataset dictionary
         :type dir_path: string
+        :param compact: (optional) whether to keep the metadata in the compact representation. See _compact_entry
+        :type compact: bool
         :return: loaded dataset
         :rtype: dict
         """
+        if is_archive(dir_path):
+            return self._load_archive(dir_path, compact=compact)
+
         dataset = dict()
 
         dir_path = Path(dir_path)
         for path in dir_path.iterdir():
             if path.suffix in self._metadata_extensions:
-                try:
-                    metadata = pd.read_excel(path)
-                except XLRDError:
-                    metadata = pd.read_excel(path, engine='openpyxl')
-
-                metadata = metadata.dropna(how="all")
-                metadata = metadata.loc[:, ~metadata.columns.str.contains('^Unnamed')]
+                metadata = self._read_metadata(path)
 
                 key = path.stem
                 value = {
                     "path": path,
                     "metadata": metadata
                 }
+                if compact:
+                    self._compact_entry(value)
             else:
                 key = path.name
                 value = path
@@ -98,18 +252,108 @@ class Dataset(object):
 
         return dataset
 
-    def load_from_template(self, version):
+    def _load_archive(self, archive_path, compact=False):
+        """
+        Load the input dataset from a zip or tar archive into a dictionary.
+        The metadata files are read in memory, in a single pass in archive order. The other files are not extracted
+
+        :param archive_path: path to the dataset archive
+        :type archive_path: string
+        :param compact: (optional) whether to keep the metadata in the compact representation. See _compact_entry
+        :type compact: bool
+        :return: loaded dataset
+        :rtype: dict
+        """
+        dataset = dict()
+
+        archive_path = Path(archive_path)
+        with ArchiveReader(archive_path) as archive:
+            # reading the members by name would seek backwards and decompress a .tar.gz from the start each time
+            contents = dict()
+            for entry in archive.entries():
+                if not entry.is_dir and "/" not in entry.name and Path(entry.name).suffix in self._metadata_extensions:
+                    contents[entry.name] = archive.read(entry)
+
+            for name, is_dir in archive.top_level().items():
+                member = ArchiveMember(archive_path, name, is_dir=is_dir)
+                path = archive_path / name
+                if not is_dir and path.suffix in self._metadata_extensions:
+                    metadata = self._read_metadata(io.BytesIO(contents[name]))
+
+                    key = path.stem
+                    value = {
+                        "path": path,
+                        "metadata": metadata,
+                        "member": member
+                    }
+                    if compact:
+                        self._compact_entry(value)
+                else:
+                    key = name
+                    value = member
+
+                dataset[key] = value
+
+        return dataset
+
+    def _compact_entry(self, value):
+        """
+        Convert the metadata of a dataset entry to the compact representation, to hold large datasets in less memory.
+        Text columns with repeated values are stored as categorical, the other strings are interned,
+        numeric columns are downcast and the empty columns are dropped.
+        The original columns and dtypes are kept in the entry and restored when the dataset is saved
+
+        :param value: dataset entry. {"path": path, "metadata": metadata}
+        :type value: dict
+        """
+        value["metadata"], value["compact"] = compact_frame(value.get("metadata"))
+
+    def _expand_metadata(self, value):
+        """
+        Get the metadata of a dataset entry with its original columns and dtypes
+
+        :param value: dataset entry
+        :type value: dict
+        :return: metadata
+        :rtype: Pandas.DataFrame
+        """
+        metadata = value.get("metadata")
+        if value.get("compact") and isinstance(metadata, pd.DataFrame):
+            return expand_frame(metadata, value.get("compact"))
+
+        return metadata
+
+    def memory_usage(self):
+        """
+        Get the memory used by the loaded metadata
+
+        :return: memory used by each category in bytes
+        :rtype: dict
+        """
+        usage = dict()
+        for key, value in self._dataset.items():
+            if isinstance(value, dict) and isinstance(value.get("metadata"), pd.DataFrame):
+                usage[key] = int(value.get("metadata").memory_usage(index=True, deep=True).sum())
+
+        return usage
+
+    def load_from_template(self, version, compact=False):
         """
         Load dataset from SPARC template
 
         :param version: template version
         :type version: string
+        :param compact: (optional) whether to keep the metadata in the compact representation
+        :type compact: bool
         :return: loaded dataset
         :rtype: dict
         """
         self.set_version(version)
         self._dataset_path = self._get_template_dir(self._version)
-        self._dataset = self._load(str(self._dataset_path))
+        self._dataset = self._load(str(self._dataset_path), compact=compact)
+        self._clear_cache()
+        self._modified.clear()
+        self._shared.clear()
 
         return self._dataset
 
@@ -175,16 +419,19 @@ class Dataset(object):
 
         copy_tree(str(template_dir), str(save_dir))
 
-    def load_dataset(self, dataset_path=None, from_template=False, version=None):
+    def load_dataset(self, dataset_path=None, from_template=False, version=None, compact=False):
         """
         Load the input dataset into a dictionary
 
-        :param dataset_path: path to the dataset
+        :param dataset_path: path to the dataset directory, or to a .zip/.tar/.tar.gz archive of the dataset
         :type dataset_path: string
         :param from_template: whether to load the dataset from a SPARC template
         :type from_template: bool
         :param version: dataset version
         :type version: string
+        :param compact: (optional) whether to keep the metadata in a compact representation which uses less memory,
+                        e.g. when many datasets are loaded at once. The saved files are unchanged
+        :type compact: bool
         :return: loaded dataset
         :rtype: dict
         """
@@ -192,45 +439,137 @@ class Dataset(object):
             self.set_version(version)
 
         if from_template:
-            self._dataset = self.load_from_template(version=version)
+            self._dataset = self.load_from_template(version=version, compact=compact)
         else:
-            self._dataset = self._load(dataset_path)
+            self._dataset_path = Path(dataset_path)
+            self._dataset = self._load(dataset_path, compact=compact)
+            self._clear_cache()
+            self._modified.clear()
+            self._shared.clear()
 
         return self._dataset
 
-    def save(self, save_dir, remove_empty=False):
+    def _write_metadata(self, data, filename, output):
+        """
+        Write metadata using the style of the template metadata file
+
+        :param data: metadata
+        :type data: Pandas.DataFrame
+        :param filename: name of the metadata file, e.g. subjects.xlsx
+        :type filename: string
+        :param output: path to the output file, or a binary stream
+        :type output: string
+        """
+        self.set_version(self._version)
+        template_dir = self._get_template_dir(self._version)
+        _write_workbook(template_dir / filename, data, output)
+
+    def _render_metadata(self, items, max_workers=None):
+        """
+        Write metadata files in parallel in a process pool, using the style of the template metadata files
+
+        :param items: a list of (metadata, filename, output). The output is the path to the output file,
+                      or None to return the content of the file
+        :type items: list
+        :param max_workers: (optional) number of worker processes. Defaults to the number of CPUs
+        :type max_workers: int
+        :return: the content of the files written to memory, in the order of the items
+        :rtype: list
+        """
+        if not items:
+            return list()
+
+        self.set_version(self._version)
+        template_dir = self._get_template_dir(self._version)
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(_write_workbook, template_dir / filename, data,
+                                       None if output is None else str(output))
+                       for data, filename, output in items]
+            return [future.result() for future in futures]
+
+    def _get_metadata_to_save(self, value, remove_empty=False):
+        """
+        Get the metadata of a dataset entry as it is saved
+
+        :param value: dataset entry
+        :type value: dict
+        :param remove_empty: (optional) If True, remove rows which do not have values in the "Value" field
+        :type remove_empty: bool
+        :return: the filename and the metadata
+        :rtype: tuple
+        """
+        filename = Path(value.get("path")).name
+        data = self._expand_metadata(value)
+
+        if remove_empty:
+            data = self._filter(data, filename)
+
+        return filename, data
+
+    def save(self, save_dir, remove_empty=False, atomic=False, max_workers=None):
         """
         Save dataset
 
-        :param save_dir: path to the dest dir
+        :param save_dir: path to the dest dir, or to a .zip/.tar/.tar.gz archive
         :type save_dir: string
         :param remove_empty: (optional) If True, remove rows which do not have values in the "Value" field
         :type remove_empty: bool
+        :param atomic: (optional) If True, the metadata files are written in parallel in a process pool to a staging
+                       directory, which then replaces the dest dir. A failed save leaves the dest dir unchanged
+        :type atomic: bool
+        :param max_workers: (optional) number of worker processes used when atomic is True. Defaults to the number of CPUs
+        :type max_workers: int
         """
         if not self._dataset:
             msg = "Dataset not defined. Please load the dataset or the template dataset in advance."
             raise ValueError(msg)
 
+        if is_archive(save_dir):
+            # archives are always replaced atomically. atomic only enables the parallel rendering
+            self._save_archive(save_dir, remove_empty=remove_empty, parallel=atomic, max_workers=max_workers)
+            self._mark_saved(save_dir)
+            return
+
+        # the watchers of the dest dir do not reload the files written by the save
+        with ExitStack() as stack:
+            for watcher in list(self._watchers):
+                if watcher.watches(save_dir):
+                    stack.enter_context(watcher.ignore_changes())
+
+            if atomic:
+                self._save_atomic(save_dir, remove_empty=remove_empty, max_workers=max_workers)
+            else:
+                self._save_dir(save_dir, remove_empty=remove_empty)
+            self._mark_saved(save_dir)
+
+    def _save_dir(self, save_dir, remove_empty=False):
+        """
+        Save dataset to a directory. The files already in the dest dir are kept
+
+        :param save_dir: path to the dest dir
+        :type save_dir: string
+        :param remove_empty: (optional) If True, remove rows which do not have values in the "Value" field
+        :type remove_empty: bool
+        """
         save_dir = Path(save_dir)
         if not save_dir.is_dir():
             save_dir.mkdir(parents=True, exist_ok=False)
 
+        members = list()
         for key, value in self._dataset.items():
             if isinstance(value, dict):
                 file_path = Path(value.get("path"))
                 filename = file_path.name
-                data = value.get("metadata")
+                data = self._expand_metadata(value)
 
                 if remove_empty:
                     data = self._filter(data, filename)
 
                 if isinstance(data, pd.DataFrame):
-                    self.set_version(self._version)
-                    template_dir = self._get_template_dir(self._version)
-                    sf = StyleFrame.read_excel_as_template(str(template_dir / filename), data)
-                    writer = StyleFrame.ExcelWriter(Path.joinpath(save_dir, filename))
-                    sf.to_excel(writer)
-                    writer.save()
+                    self._write_metadata(data, filename, Path.joinpath(save_dir, filename))
+
+            elif isinstance(value, ArchiveMember):
+                members.append(value)
 
             elif Path(value).is_dir():
                 dir_name = Path(value).name
@@ -249,12 +588,127 @@ class Dataset(object):
                     os.remove(file_path)
                     os.rename(file_path_tmp, file_path)
 
-    def load_metadata(self, path):
+        # extract the files of a dataset loaded from an archive
+        copy_members(members, save_dir=save_dir)
+
+    def _save_archive(self, archive_path, remove_empty=False, parallel=False, max_workers=None):
+        """
+        Save dataset to a zip or tar archive.
+        The metadata files are written in memory and the other files are streamed into the archive
+
+        :param archive_path: path to the .zip/.tar/.tar.gz archive
+        :type archive_path: string
+        :param remove_empty: (optional) If True, remove rows which do not have values in the "Value" field
+        :type remove_empty: bool
+        :param parallel: (optional) If True, the metadata files are written in parallel in a process pool
+        :type parallel: bool
+        :param max_workers: (optional) number of worker processes. Defaults to the number of CPUs
+        :type max_workers: int
+        """
+        rendered = dict()
+        if parallel:
+            items = OrderedDict()
+            for key, value in self._dataset.items():
+                if isinstance(value, dict):
+                    filename, data = self._get_metadata_to_save(value, remove_empty=remove_empty)
+                    if isinstance(data, pd.DataFrame):
+                        items[key] = (data, filename, None)
+            rendered = dict(zip(items.keys(), self._render_metadata(list(items.values()), max_workers=max_workers)))
+
+        members = list()
+        with ArchiveWriter(archive_path) as writer:
+            for key, value in self._dataset.items():
+                if key in rendered:
+                    writer.add_bytes(Path(value.get("path")).name, rendered[key])
+
+                elif isinstance(value, dict):
+                    filename, data = self._get_metadata_to_save(value, remove_empty=remove_empty)
+
+                    if isinstance(data, pd.DataFrame):
+                        buffer = io.BytesIO()
+                        self._write_metadata(data, filename, buffer)
+                        writer.add_bytes(filename, buffer.getvalue())
+
+                elif isinstance(value, ArchiveMember):
+                    members.append(value)
+
+                elif Path(value).exists():
+                    writer.add_path(value, Path(value).name)
+
+            copy_members(members, writer=writer)
+
+    def _save_atomic(self, save_dir, remove_empty=False, max_workers=None):
+        """
+        Save dataset to a staging directory next to the dest dir, then swap it into place with renames.
+        The files already in the dest dir are hard linked (or copied) into the staging directory first,
+        so they are kept like in the normal save. The metadata files are written in parallel in a process pool
+
+        :param save_dir: path to the dest dir
+        :type save_dir: string
+        :param remove_empty: (optional) If True, remove rows which do not have values in the "Value" field
+        :type remove_empty: bool
+        :param max_workers: (optional) number of worker processes. Defaults to the number of CPUs
+        :type max_workers: int
+        """
+        save_dir = Path(save_dir).absolute()
+        save_dir.parent.mkdir(parents=True, exist_ok=True)
+
+        # the staging directory is in the parent of the dest dir, on the same filesystem, so it can be renamed into place
+        staging_root = Path(tempfile.mkdtemp(prefix="." + save_dir.name + ".", dir=str(save_dir.parent)))
+        staging_dir = staging_root / save_dir.name
+        backup_dir = staging_root / (save_dir.name + ".backup")
+        try:
+            if save_dir.is_dir():
+                shutil.copytree(str(save_dir), str(staging_dir), copy_function=_link_or_copy)
+            else:
+                staging_dir.mkdir()
+
+            items = list()
+            members = list()
+            for key, value in self._dataset.items():
+                if isinstance(value, dict):
+                    filename, data = self._get_metadata_to_save(value, remove_empty=remove_empty)
+                    if isinstance(data, pd.DataFrame):
+                        output = staging_dir / filename
+                        # replace the file hard linked from the dest dir instead of writing through the link
+                        if os.path.lexists(str(output)):
+                            output.unlink()
+                        items.append((data, filename, output))
+
+                elif isinstance(value, ArchiveMember):
+                    members.append(value)
+
+                # only the files of the old dest dir, which is removed after the swap, are hard linked.
+                # the files of another dataset are copied, so the saved dataset does not share them with its source
+                elif Path(value).is_dir():
+                    _copy_tree(value, staging_dir / Path(value).name, link=_is_within(value, save_dir))
+
+                elif Path(value).is_file():
+                    _link_or_copy(value, staging_dir / Path(value).name, link=_is_within(value, save_dir))
+
+            copy_members(members, save_dir=staging_dir)
+            self._render_metadata(items, max_workers=max_workers)
+
+            if save_dir.exists():
+                os.rename(str(save_dir), str(backup_dir))
+            try:
+                os.rename(str(staging_dir), str(save_dir))
+            except OSError:
+                # roll back to the previous dest dir
+                if backup_dir.exists():
+                    os.rename(str(backup_dir), str(save_dir))
+                raise
+        finally:
+            shutil.rmtree(str(staging_root), ignore_errors=True)
+
+    def load_metadata(self, path, compact=False):
         """
         Load & update a single metadata
 
         :param path: path to the metadata file
         :type path: string
+        :param compact: (optional) whether to keep the metadata in the compact representation. See load_dataset
+        :type compact: bool
         :return: metadata
         :rtype: Pandas.DataFrame
         """
@@ -269,9 +723,415 @@ class Dataset(object):
             "path": path,
             "metadata": metadata
         }
+        if compact:
+            self._compact_entry(self._dataset[filename])
+            metadata = self._dataset[filename]["metadata"]
+        self._clear_cache()
+        self._modified.discard(filename)
+        self._shared.discard(filename)
 
         return metadata
 
+    def watch(self, callback=None, conflict_callback=None, reload_conflicts=False, interval=1.0, use_inotify=True):
+        """
+        Watch the dataset directory and reload the metadata files which are changed on disk.
+        Only the changed metadata files are read again. See DatasetWatcher for more information
+
+        :param callback: (optional) a function called with the list of the reloaded categories
+        :type callback: function
+        :param conflict_callback: (optional) a function called with the list of the categories changed on disk
+                                  while they have unsaved changes in memory
+        :type conflict_callback: function
+        :param reload_conflicts: (optional) if True, conflicting categories are reloaded and the in-memory changes are lost
+        :type reload_conflicts: bool
+        :param interval: (optional) polling interval in seconds
+        :type interval: float
+        :param use_inotify: (optional) whether to use inotify when available (Linux)
+        :type use_inotify: bool
+        :return: the started watcher. Call watcher.stop() to stop watching
+        :rtype: DatasetWatcher
+        """
+        watcher = DatasetWatcher(self, callback=callback, conflict_callback=conflict_callback,
+                                 reload_conflicts=reload_conflicts, interval=interval, use_inotify=use_inotify)
+
+        return watcher.start()
+
+    def _get_metadata_path(self, category):
+        """
+        Get the path to the metadata file of a category
+
+        :param category: metadata category
+        :type category: string
+        :return: path to the metadata file
+        :rtype: Path
+        """
+        data = self._dataset.get(category)
+        if isinstance(data, dict):
+            return Path(data.get("path"))
+
+        for extension in self._metadata_extensions:
+            path = self._dataset_path / (category + extension)
+            if path.is_file():
+                return path
+
+        msg = "Metadata file not found for category: " + str(category)
+        raise ValueError(msg)
+
+    def _open_metadata(self, category):
+        """
+        Get the saved metadata file of a category to be streamed
+
+        :param category: metadata category
+        :type category: string
+        :return: path to the metadata file, or a binary stream if the file is in an archive
+        :rtype: Path
+        """
+        data = self._dataset.get(category)
+        if isinstance(data, dict) and data.get("member") is not None:
+            # the metadata file is in an archive
+            member = data.get("member")
+            with ArchiveReader(member.archive_path) as archive:
+                return io.BytesIO(archive.read(member.name))
+
+        return self._get_metadata_path(category)
+
+    def iter_rows(self, category, columns=None, chunksize=None):
+        """
+        Iterate over the rows of a metadata file without loading the whole workbook.
+        The rows are streamed from the saved file (or archive member), so unsaved changes made with set_field/append are not included.
+
+        :param category: metadata category
+        :type category: string
+        :param columns: (optional) names of the columns to return. Defaults to all columns
+        :type columns: list
+        :param chunksize: (optional) if provided, yield DataFrames with up to chunksize rows instead of single rows
+        :type chunksize: int
+        :return: an iterator of rows (dict) or DataFrame chunks
+        :rtype: iterator
+        """
+        return iter_excel_rows(self._open_metadata(category), columns=columns, chunksize=chunksize)
+
+    def write_rows(self, category, rows, save_dir, columns=None):
+        """
+        Write the rows of a metadata file without keeping the whole category in memory.
+        Combined with iter_rows, this allows very large categories to be transformed with constant memory, e.g.
+        dataset.write_rows("manifest", (transform(chunk) for chunk in dataset.iter_rows("manifest", chunksize=1000)), save_dir)
+
+        :param category: metadata category
+        :type category: string
+        :param rows: an iterable of rows (dict) and/or DataFrame chunks
+        :type rows: iterable
+        :param save_dir: path to the dest dir
+        :type save_dir: string
+        :param columns: (optional) column names. Defaults to the columns of the first chunk (or the keys of the first row).
+                        If rows is empty, defaults to the header of the saved metadata file, or of the template
+        :type columns: list
+        :return: path to the saved metadata file
+        :rtype: Path
+        """
+        save_dir = Path(save_dir)
+        if not save_dir.is_dir():
+            save_dir.mkdir(parents=True, exist_ok=False)
+
+        self.set_version(self._version)
+        filename = category + self._metadata_extensions[0]
+        # the template is only used for the style of the header and the column widths
+        template_path = self._get_template_dir(self._version) / filename
+        file_path = save_dir / filename
+
+        try:
+            header = [name for name in read_excel_header(self._open_metadata(category)) if name is not None]
+        except (ValueError, OSError):
+            # the category has not been saved yet
+            header = None
+
+        if file_path.exists():
+            # rows may still be streamed from the existing file. write to a temporary file then rename
+            file_path_tmp = save_dir / (filename + "_tmp")
+            try:
+                write_excel_rows(file_path_tmp, rows, columns=columns, template_path=template_path, header=header)
+            except Exception:
+                if file_path_tmp.exists():
+                    file_path_tmp.unlink()
+                raise
+            os.replace(str(file_path_tmp), str(file_path))
+        else:
+            write_excel_rows(file_path, rows, columns=columns, template_path=template_path, header=header)
+
+        return file_path
+
+    def _clear_cache(self):
+        """
+        Clear the cached query results. Called whenever the loaded metadata changes
+        """
+        self._query_cache.clear()
+
+    def _mark_modified(self, category):
+        """
+        Record that a category has been changed in memory
+
+        :param category: metadata category
+        :type category: string
+        """
+        self._modified.add(category)
+        self._shared.discard(category)
+        self._clear_cache()
+
+    def _get_writable_metadata(self, category):
+        """
+        Get the metadata of a category to change it in place.
+        If the metadata is shared with a snapshot, it is copied first
+
+        :param category: metadata category
+        :type category: string
+        :return: metadata
+        :rtype: Pandas.DataFrame
+        """
+        data = self._dataset.get(category)
+        if category in self._shared:
+            data["metadata"] = data.get("metadata").copy()
+            self._shared.discard(category)
+
+        return data.get("metadata")
+
+    def snapshot(self):
+        """
+        Take a snapshot of the loaded dataset, e.g. to undo a batch of set_field/append calls.
+        The metadata is not copied: a category is only copied when it is changed after the snapshot
+
+        :return: the snapshot
+        :rtype: Snapshot
+        """
+        dataset = {key: dict(value) if isinstance(value, dict) else value for key, value in self._dataset.items()}
+        self._shared = set(key for key, value in self._dataset.items() if isinstance(value, dict))
+
+        return Snapshot(dataset, set(self._modified), self._dataset_path, self._version)
+
+    def restore(self, snapshot):
+        """
+        Restore the dataset to a snapshot. The snapshot can be restored again later
+
+        :param snapshot: a snapshot taken with snapshot()
+        :type snapshot: Snapshot
+        :return: restored dataset
+        :rtype: dict
+        """
+        if not isinstance(snapshot, Snapshot):
+            msg = "snapshot should be a 'Snapshot' created by Dataset.snapshot()."
+            raise ValueError(msg)
+
+        self._dataset = {key: dict(value) if isinstance(value, dict) else value
+                         for key, value in snapshot._dataset.items()}
+        self._shared = set(key for key, value in self._dataset.items() if isinstance(value, dict))
+        self._modified = set(snapshot._modified)
+        self._dataset_path = snapshot._dataset_path
+        self._version = snapshot._version
+        self._clear_cache()
+
+        return self._dataset
+
+    def _mark_saved(self, save_dir):
+        """
+        Record that the changes have been saved, if the dataset was saved to its own path
+
+        :param save_dir: path the dataset was saved to
+        :type save_dir: string
+        """
+        if Path(save_dir).resolve() == self._dataset_path.resolve():
+            self._modified.clear()
+
+    def _cache(self, key, load):
+        """
+        Return a cached value, or load and cache it
+
+        :param key: cache key
+        :type key: tuple
+        :param load: function to load the value if it is not cached
+        :type load: function
+        :return: the cached value
+        :rtype: object
+        """
+        if key in self._query_cache:
+            self._query_cache.move_to_end(key)
+            return self._query_cache[key]
+
+        value = load()
+        self._query_cache[key] = value
+        if len(self._query_cache) > self._query_cache_size:
+            self._query_cache.popitem(last=False)
+
+        return value
+
+    def _get_source(self, category):
+        """
+        Get the loaded metadata of a category, or the signature of its metadata file if it is not loaded
+
+        :param category: metadata category
+        :type category: string
+        :return: the loaded metadata (or None) and a key identifying the current content of the category
+        :rtype: tuple
+        """
+        data = self._dataset.get(category)
+        if isinstance(data, dict) and isinstance(data.get("metadata"), pd.DataFrame):
+            metadata = data.get("metadata")
+            return metadata, ("memory", id(metadata))
+
+        path = self._get_metadata_path(category)
+        stat = path.stat()
+        return None, (str(path), stat.st_mtime_ns, stat.st_size)
+
+    def _get_header(self, category):
+        """
+        Get the column names of a category without loading its rows
+
+        :param category: metadata category
+        :type category: string
+        :return: column names
+        :rtype: list
+        """
+        metadata, source = self._get_source(category)
+        if metadata is not None:
+            compact = self._dataset[category].get("compact")
+            return get_columns(metadata, compact) if compact else list(metadata.columns)
+
+        load = lambda: [name for name in read_excel_header(source[0]) if name is not None]
+        return self._cache(("columns", category, source), load)
+
+    def _get_columns(self, category):
+        """
+        Get the columns of a category available to queries: its columns, followed by the SPARC id columns
+        derived from its file paths (e.g. "subject id" and "sample id" for the manifest)
+
+        :param category: metadata category
+        :type category: string
+        :return: column names
+        :rtype: list
+        """
+        header = self._get_header(category)
+
+        return header + get_path_id_columns(header)
+
+    def _select(self, category, columns, filters):
+        """
+        Select the columns and the rows that match the filters from a category.
+        If the category is not loaded, only the selected columns and the matching rows are read from the metadata file.
+
+        :param category: metadata category
+        :type category: string
+        :param columns: names of the columns to select
+        :type columns: list
+        :param filters: a list of (column, operator, value) filters
+        :type filters: list
+        :return: the selected metadata
+        :rtype: Pandas.DataFrame
+        """
+        metadata, source = self._get_source(category)
+        needed = columns + [column for column, op, operand in filters if column not in columns]
+        derived = [column for column in get_path_id_columns(self._get_header(category)) if column in needed]
+
+        def load():
+            if metadata is not None:
+                data = add_path_ids(self._expand_metadata(self._dataset[category]), derived)
+                return filter_frame(data, filters)[columns].copy()
+
+            read = [column for column in needed if column not in derived]
+            if derived and PATH_COLUMN not in read:
+                read.append(PATH_COLUMN)
+            chunks = [filter_frame(add_path_ids(chunk, derived), filters)[columns]
+                      for chunk in iter_excel_rows(source[0], columns=read, chunksize=1000)]
+            if not chunks:
+                return pd.DataFrame(columns=columns)
+            return pd.concat(chunks)
+
+        key = ("select", category, source, tuple(columns), repr(filters))
+        return self._cache(key, load)
+
+    def query(self, categories, columns=None, filters=None, how="inner"):
+        """
+        Query and join the metadata categories, e.g. subjects, samples, performances and manifest.
+        The categories are joined in the given order on the most specific SPARC id column (e.g. "sample id") they have in common.
+        The "subject id", "sample id" and "performance id" of the manifest are derived from the folders of its file paths
+        (e.g. "primary/sub-1/perf-1/recording.csv"). The performances have no subject or sample id, so join them through
+        the manifest, e.g. ["subjects", "manifest", "performances"].
+        If a category is not loaded, only the columns and the rows needed by the query are read from the metadata file.
+        Repeated queries are served from a cache until the metadata changes.
+
+        :param categories: metadata categories to join, e.g. ["subjects", "samples"]
+        :type categories: list
+        :param columns: (optional) the columns to return. Each column is taken from the first category which has it.
+                        Defaults to all the columns
+        :type columns: list
+        :param filters: (optional) a list of (column, operator, value) filters, e.g. [("species", "==", "human"), ("age", ">", 50)].
+                        Operators: "==", "!=", "<", "<=", ">", ">=", "in", "not in", "contains", or a function taking (value, operand).
+                        Each filter is applied to the first category which has the column
+        :type filters: list
+        :param how: (optional) type of join: "inner", "left", "right" or "outer"
+        :type how: string
+        :return: the query result
+        :rtype: Pandas.DataFrame
+        """
+        if isinstance(categories, str):
+            categories = [categories]
+        filters = list(filters or list())
+
+        headers = OrderedDict((category, self._get_columns(category)) for category in categories)
+
+        def find_category(column):
+            for category, header in headers.items():
+                if column in header:
+                    return category
+            msg = "Column not found in categories " + str(categories) + ": " + str(column)
+            raise ValueError(msg)
+
+        if columns is None:
+            selected = OrderedDict((category, list(header)) for category, header in headers.items())
+        else:
+            selected = OrderedDict((category, list()) for category in categories)
+            for column in columns:
+                selected[find_category(column)].append(column)
+
+        # filters are pushed down into the categories whose rows are all kept by the joins. the filters on the other
+        # categories are applied after the joins, so they drop the unmatched rows instead of leaving NaNs
+        preserved = {"inner": categories, "left": categories[:1], "right": categories[-1:]}.get(how, list())
+        category_filters = OrderedDict((category, list()) for category in categories)
+        join_filters = list()
+        for column, op, operand in filters:
+            category = find_category(column)
+            if category in preserved:
+                category_filters[category].append((column, op, operand))
+            else:
+                join_filters.append((column, op, operand))
+                if column not in selected[category]:
+                    selected[category].append(column)
+
+        # find the join columns and make sure they are selected on both sides of each join
+        join_keys = dict()
+        joined = list(headers[categories[0]])
+        for category in categories[1:]:
+            key = find_join_key(joined, headers[category])
+            if key is None:
+                msg = "No SPARC id column to join " + str(category) + " with " + str(categories[:categories.index(category)])
+                raise ValueError(msg)
+            join_keys[category] = key
+            for owner in [find_category(key), category]:
+                if key not in selected[owner]:
+                    selected[owner].append(key)
+            joined.extend(headers[category])
+
+        result = None
+        for category in categories:
+            metadata = self._select(category, selected[category], category_filters[category])
+            if result is None:
+                result = metadata
+            else:
+                result = result.merge(metadata, on=join_keys[category], how=how, suffixes=("", "_" + category))
+        result = filter_frame(result, join_filters)
+
+        if columns is not None:
+            result = result[list(columns)]
+
+        return result.copy()
+
     def _filter(self, metadata, filename):
         """
         Remove column/row if values not set
@@ -391,7 +1251,7 @@ class Dataset(object):
             msg = "Dataset not defined. Please load the dataset in advance."
             raise ValueError(msg)
 
-        metadata = self._dataset.get(category).get("metadata")
+        metadata = self._get_writable_metadata(category)
 
         if not isinstance(row_index, int):
             msg = "row_index should be 'int'."
@@ -400,12 +1260,16 @@ class Dataset(object):
         try:
             # Convert Excel row index to dataframe index: index - 2
             row_index = row_index - 2
+            compact = self._dataset[category].get("compact")
+            if compact:
+                prepare_column(metadata, header, value, compact)
             metadata.loc[row_index, header] = value
         except ValueError:
             msg = "Value error. row does not exists."
             raise ValueError(msg)
 
         self._dataset[category]["metadata"] = metadata
+        self._mark_modified(category)
 
         return self._dataset
 
@@ -428,5 +1292,6 @@ class Dataset(object):
         metadata = metadata.append(row, ignore_index=True)
 
         self._dataset[category]["metadata"] = metadata
+        self._mark_modified(category)
 
         return self._dataset
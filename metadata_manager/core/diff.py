@@ -0,0 +1,505 @@
+import hashlib
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from metadata_manager.core.archive import ArchiveMember, ArchiveReader, is_archive
+from metadata_manager.core.dataset import Dataset
+from metadata_manager.core.query import SPARC_ID_COLUMNS
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def _to_value(value):
+    """
+    Convert a cell value for the change set, so it can be serialised to JSON. NaN is converted to None,
+    numpy values to the Python values and dates/times to ISO 8601 strings
+
+    :param value: cell value
+    :type value: object
+    :return: cell value
+    :rtype: object
+    """
+    try:
+        if pd.isnull(value):
+            return None
+    except (TypeError, ValueError):
+        pass
+
+    if isinstance(value, np.datetime64):
+        value = pd.Timestamp(value)
+    if isinstance(value, np.generic):
+        return value.item()
+    if hasattr(value, "isoformat"):
+        # datetime, date, time, pandas Timestamp and Timedelta
+        return value.isoformat()
+    return value
+
+
+def _to_row(items):
+    """
+    Convert a row for the change set. Empty cells are left out to keep the change set compact
+
+    :param items: (column, value) pairs
+    :type items: iterable
+    :return: row
+    :rtype: dict
+    """
+    row = dict()
+    for column, value in items:
+        value = _to_value(value)
+        if value is not None:
+            row[column] = value
+
+    return row
+
+
+def hash_file(path):
+    """
+    Hash the content of a file
+
+    :param path: path to the file
+    :type path: string
+    :return: SHA-256 hex digest
+    :rtype: string
+    """
+    digest = hashlib.sha256()
+    with open(str(path), "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def same_file(old_path, new_path, content=False):
+    """
+    Check whether two files are the same.
+    Files of different sizes are different. Otherwise the files are compared by
+    modification time, or by content hash if content is True
+
+    :param old_path: path to the old file
+    :type old_path: string
+    :param new_path: path to the new file
+    :type new_path: string
+    :param content: (optional) whether to compare the file content instead of the modification time
+    :type content: bool
+    :return: True if the files are the same
+    :rtype: bool
+    """
+    old_stat = os.stat(str(old_path))
+    new_stat = os.stat(str(new_path))
+    if old_stat.st_size != new_stat.st_size:
+        return False
+    if content:
+        return hash_file(old_path) == hash_file(new_path)
+
+    return old_stat.st_mtime_ns == new_stat.st_mtime_ns
+
+
+def _same(old, new, content=False):
+    """
+    Check whether two files are the same. The files can be on disk or in an archive
+
+    :param old: path to the old file, or (archive path, archive entry)
+    :type old: Path or tuple
+    :param new: path to the new file, or (archive path, archive entry)
+    :type new: Path or tuple
+    :param content: (optional) whether to compare the file content instead of the modification time
+    :type content: bool
+    :return: True if the files are the same
+    :rtype: bool
+    """
+    if not isinstance(old, tuple) and not isinstance(new, tuple):
+        return same_file(old, new, content=content)
+
+    def info(item):
+        if isinstance(item, tuple):
+            return item[1].size, item[1].mtime
+        stat = os.stat(str(item))
+        return stat.st_size, stat.st_mtime
+
+    def digest(item):
+        if not isinstance(item, tuple):
+            return hash_file(item)
+        sha = hashlib.sha256()
+        with ArchiveReader(item[0]) as archive, archive.open(item[1]) as f:
+            for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+                sha.update(block)
+        return sha.hexdigest()
+
+    old_size, old_mtime = info(old)
+    new_size, new_mtime = info(new)
+    if old_size != new_size:
+        return False
+    if content:
+        return digest(old) == digest(new)
+
+    # archives store the modification time with a lower resolution
+    return int(old_mtime) == int(new_mtime)
+
+
+def _get_source(dataset):
+    """
+    Collect the metadata and the other files of a dataset
+
+    :param dataset: a loaded dataset or the path to a dataset directory
+    :type dataset: Dataset or string
+    :return: dataset root, {category: (path, metadata or None if not loaded)} and {relative path: path}
+    :rtype: tuple
+    """
+    metadata = dict()
+    files = dict()
+
+    if isinstance(dataset, Dataset):
+        root = Path(dataset.get_dataset_path())
+        members = list()
+        for key, value in dataset._dataset.items():
+            if isinstance(value, dict):
+                metadata[key] = (Path(value.get("path")), dataset._expand_metadata(value))
+            elif isinstance(value, ArchiveMember):
+                members.append(value)
+            elif Path(value).is_dir():
+                for path in Path(value).rglob("*"):
+                    if path.is_file():
+                        files[str(path.relative_to(Path(value).parent))] = path
+            elif Path(value).is_file():
+                files[Path(value).name] = Path(value)
+        for member in members:
+            with ArchiveReader(member.archive_path) as archive:
+                for entry in archive.entries():
+                    if member.contains(entry.name) and not entry.is_dir:
+                        files[entry.name] = (member.archive_path, entry)
+        return root, metadata, files
+
+    root = Path(dataset)
+    if not root.is_dir():
+        msg = "Dataset not found: " + str(root)
+        raise ValueError(msg)
+
+    extensions = Dataset()._metadata_extensions
+    for path in root.iterdir():
+        if path.is_file() and path.suffix in extensions:
+            metadata[path.stem] = (path, None)
+        elif path.is_file():
+            files[path.name] = path
+        elif path.is_dir():
+            for sub_path in path.rglob("*"):
+                if sub_path.is_file():
+                    files[str(sub_path.relative_to(root))] = sub_path
+
+    return root, metadata, files
+
+
+def _find_key(old, new):
+    """
+    Find the column identifying the rows of a category: a SPARC id column or the first column
+    (e.g. "Metadata element") if its values are unique in both versions
+
+    :param old: old metadata
+    :type old: Pandas.DataFrame
+    :param new: new metadata
+    :type new: Pandas.DataFrame
+    :return: key column, or None to match the rows by position
+    :rtype: string
+    """
+    candidates = [column for column in SPARC_ID_COLUMNS if column in old.columns]
+    if len(old.columns):
+        candidates.append(old.columns[0])
+
+    for column in candidates:
+        if column not in new.columns:
+            continue
+        if all(metadata[column].notnull().all() and metadata[column].is_unique for metadata in (old, new)):
+            return column
+
+    return None
+
+
+def _row_hashes(metadata, columns, key):
+    """
+    Hash the rows of a category
+
+    :param metadata: metadata
+    :type metadata: Pandas.DataFrame
+    :param columns: columns to hash
+    :type columns: list
+    :param key: key column, or None to use the row index
+    :type key: string
+    :return: row hashes indexed by row key
+    :rtype: Pandas.Series
+    """
+    hashes = pd.util.hash_pandas_object(metadata.reindex(columns=columns), index=False)
+    keys = metadata[key] if key else metadata.index
+
+    return pd.Series(hashes.values, index=keys)
+
+
+def diff_metadata(old, new):
+    """
+    Compare two versions of the metadata of a category.
+    Rows are matched by key (see _find_key) and compared by hash; cells are only compared for the rows whose hash changed
+
+    :param old: old metadata
+    :type old: Pandas.DataFrame
+    :param new: new metadata
+    :type new: Pandas.DataFrame
+    :return: changes with the "key", "columns_added", "columns_removed", "added" (rows), "removed" (row keys)
+             and "modified" ([{"key": key, "cells": {column: [old value, new value]}}]) keys
+    :rtype: dict
+    """
+    columns = list(old.columns) + [column for column in new.columns if column not in old.columns]
+    key = _find_key(old, new)
+
+    old_hashes = _row_hashes(old, columns, key)
+    new_hashes = _row_hashes(new, columns, key)
+
+    added = new_hashes.index.difference(old_hashes.index, sort=False)
+    removed = old_hashes.index.difference(new_hashes.index, sort=False)
+    common = old_hashes.index.intersection(new_hashes.index, sort=False)
+    candidates = common[(old_hashes[common].values != new_hashes[common].values)]
+
+    old_rows = old.set_index(old[key]) if key else old
+    new_rows = new.set_index(new[key]) if key else new
+    new_rows = new_rows.reindex(columns=columns)
+
+    modified = list()
+    if len(candidates):
+        old_values = old_rows.reindex(columns=columns).loc[candidates]
+        new_values = new_rows.loc[candidates]
+        for row_key in candidates:
+            cells = dict()
+            for column in columns:
+                old_value = _to_value(old_values.at[row_key, column])
+                new_value = _to_value(new_values.at[row_key, column])
+                if old_value != new_value:
+                    cells[column] = [old_value, new_value]
+            if cells:
+                modified.append({"key": _to_value(row_key), "cells": cells})
+
+    changes = {
+        "key": key,
+        "columns_added": [column for column in new.columns if column not in old.columns],
+        "columns_removed": [column for column in old.columns if column not in new.columns],
+        "added": [_to_row(new_rows.loc[row_key].items()) for row_key in added],
+        "removed": [_to_value(row_key) for row_key in removed],
+        "modified": modified,
+    }
+
+    return changes
+
+
+class ChangeSet(object):
+    """
+    Changes between two versions of a dataset.
+
+    metadata: {category: changes}. See diff_metadata for the format of the changes.
+              A category which only exists in one version has the "status" "added" or "removed"
+    files: {"added": [relative path], "removed": [relative path], "modified": [relative path]}
+    """
+
+    def __init__(self, old_root=None, new_root=None):
+        self.old_root = old_root
+        self.new_root = new_root
+        self.metadata = dict()
+        self.files = {"added": list(), "removed": list(), "modified": list()}
+
+    def __repr__(self):
+        return "ChangeSet(" + str(self.summary()) + ")"
+
+    def is_empty(self):
+        """
+        Check whether there are no changes
+
+        :return: True if there are no changes
+        :rtype: bool
+        """
+        return not self.metadata and not any(self.files.values())
+
+    def summary(self):
+        """
+        Count the changes
+
+        :return: number of added/removed/modified rows for each category, and number of added/removed/modified files
+        :rtype: dict
+        """
+        summary = dict()
+        for category, changes in self.metadata.items():
+            summary[category] = {name: len(changes.get(name, list())) for name in ("added", "removed", "modified")}
+        summary["files"] = {name: len(paths) for name, paths in self.files.items()}
+
+        return summary
+
+    def to_dict(self):
+        """
+        Convert the change set to a dictionary which can be serialised to JSON
+
+        :return: {"old_root": path, "new_root": path, "metadata": {category: changes},
+                  "files": {"added": [], "removed": [], "modified": []}}
+        :rtype: dict
+        """
+        return {
+            "old_root": None if self.old_root is None else str(self.old_root),
+            "new_root": None if self.new_root is None else str(self.new_root),
+            "metadata": self.metadata,
+            "files": self.files,
+        }
+
+    @classmethod
+    def from_dict(cls, data, old_root=None, new_root=None):
+        """
+        Create a change set from a dictionary returned by to_dict, e.g. loaded from JSON
+
+        :param data: the change set dictionary
+        :type data: dict
+        :param old_root: (optional) path to the old dataset. Defaults to the "old_root" of the dictionary
+        :type old_root: string
+        :param new_root: (optional) path to the new dataset. Defaults to the "new_root" of the dictionary
+        :type new_root: string
+        :return: the change set
+        :rtype: ChangeSet
+        """
+        old_root = old_root if old_root is not None else data.get("old_root")
+        new_root = new_root if new_root is not None else data.get("new_root")
+        change_set = cls(old_root=None if old_root is None else Path(old_root),
+                         new_root=None if new_root is None else Path(new_root))
+        change_set.metadata = dict(data.get("metadata", dict()))
+        for name in change_set.files:
+            change_set.files[name] = list(data.get("files", dict()).get(name, list()))
+
+        return change_set
+
+    def apply(self, dataset):
+        """
+        Apply the metadata changes to a loaded dataset, e.g. the old version of the dataset
+
+        :param dataset: the dataset to patch
+        :type dataset: Dataset
+        :return: updated dataset
+        :rtype: dict
+        """
+        for category, changes in self.metadata.items():
+            status = changes.get("status")
+            if status == "removed":
+                dataset._dataset.pop(category, None)
+                continue
+
+            if status == "added" or category not in dataset._dataset:
+                metadata = pd.DataFrame(changes.get("added"), columns=changes.get("columns"))
+                path = Path(dataset.get_dataset_path()) / changes.get("filename", category + ".xlsx")
+                dataset._dataset[category] = {"path": path, "metadata": metadata}
+                continue
+
+            metadata = dataset._expand_metadata(dataset._dataset[category]).copy()
+            key = changes.get("key")
+
+            for column in changes.get("columns_added"):
+                metadata[column] = None
+            lookup = pd.Series(metadata.index, index=metadata[key] if key else metadata.index)
+
+            for row in changes.get("modified"):
+                for column, (old_value, new_value) in row["cells"].items():
+                    metadata.loc[lookup[row["key"]], column] = new_value
+
+            metadata = metadata.drop(index=[lookup[row_key] for row_key in changes.get("removed")])
+            metadata = metadata.drop(columns=changes.get("columns_removed"))
+            if changes.get("added"):
+                added = pd.DataFrame(changes.get("added"), columns=list(metadata.columns))
+                metadata = pd.concat([metadata, added], ignore_index=True)
+
+            dataset._dataset[category]["metadata"] = metadata
+            if dataset._dataset[category].get("compact"):
+                dataset._compact_entry(dataset._dataset[category])
+
+        for category in self.metadata:
+            dataset._mark_modified(category)
+
+        return dataset._dataset
+
+    def apply_files(self, target_dir):
+        """
+        Apply the file changes to a dataset directory. Added and modified files are copied from the new dataset
+
+        :param target_dir: path to the dataset directory to patch
+        :type target_dir: string
+        """
+        if (self.new_root is None or is_archive(self.new_root)) and (self.files["added"] or self.files["modified"]):
+            msg = "The new dataset directory is required to apply the file changes."
+            raise ValueError(msg)
+
+        target_dir = Path(target_dir)
+        for relative_path in self.files["added"] + self.files["modified"]:
+            target_path = target_dir / relative_path
+            target_path.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy2(str(Path(self.new_root) / relative_path), str(target_path))
+
+        for relative_path in self.files["removed"]:
+            target_path = target_dir / relative_path
+            if target_path.is_file():
+                os.remove(str(target_path))
+
+
+def diff_datasets(old, new, content=False):
+    """
+    Compare two versions of a dataset.
+    Metadata files with the same size and modification time (or content hash if content is True) are skipped without
+    being read. Otherwise the rows are compared by hash, and cells are only compared for the rows which changed
+
+    :param old: the old dataset. A loaded dataset (from a directory or an archive) or the path to a dataset directory
+    :type old: Dataset or string
+    :param new: the new dataset. A loaded dataset (from a directory or an archive) or the path to a dataset directory
+    :type new: Dataset or string
+    :param content: (optional) whether to compare the files by content hash instead of modification time
+    :type content: bool
+    :return: the changes between the two versions
+    :rtype: ChangeSet
+    """
+    reader = Dataset()
+    old_root, old_metadata, old_files = _get_source(old)
+    new_root, new_metadata, new_files = _get_source(new)
+
+    change_set = ChangeSet(old_root=old_root, new_root=new_root)
+
+    for category in list(old_metadata) + [category for category in new_metadata if category not in old_metadata]:
+        if category not in new_metadata:
+            change_set.metadata[category] = {"status": "removed"}
+            continue
+
+        new_path, new_data = new_metadata[category]
+        if category not in old_metadata:
+            if new_data is None:
+                new_data = reader._read_metadata(new_path)
+            change_set.metadata[category] = {
+                "status": "added",
+                "filename": new_path.name,
+                "columns": list(new_data.columns),
+                "added": [_to_row(row.items()) for row in new_data.to_dict(orient="records")],
+            }
+            continue
+
+        old_path, old_data = old_metadata[category]
+        if old_data is not None and old_data is new_data:
+            continue
+        if old_data is None and new_data is None and same_file(old_path, new_path, content=content):
+            continue
+
+        if old_data is None:
+            old_data = reader._read_metadata(old_path)
+        if new_data is None:
+            new_data = reader._read_metadata(new_path)
+
+        changes = diff_metadata(old_data, new_data)
+        if any(changes[name] for name in ("columns_added", "columns_removed", "added", "removed", "modified")):
+            changes["status"] = "modified"
+            change_set.metadata[category] = changes
+
+    for relative_path, path in new_files.items():
+        if relative_path not in old_files:
+            change_set.files["added"].append(relative_path)
+        elif not _same(old_files[relative_path], path, content=content):
+            change_set.files["modified"].append(relative_path)
+    change_set.files["removed"] = [relative_path for relative_path in old_files if relative_path not in new_files]
+
+    return change_set
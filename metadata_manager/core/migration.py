@@ -0,0 +1,549 @@
+import os
+import shutil
+import tempfile
+import time
+import traceback
+from functools import lru_cache
+from pathlib import Path
+
+import pandas as pd
+
+from metadata_manager.core.batch import find_datasets, run_tasks
+from metadata_manager.core.dataset import Dataset, _write_workbook
+from metadata_manager.utils.streaming import iter_excel_rows, read_excel_header, write_excel_rows
+
+# Declarative mappings between template versions.
+#   "sheets": source category -> target category. Categories of the target template which are not mapped
+#             are created from the target template
+#   "columns": category -> {source column: target column}. A target column of None drops the column.
+#              Source columns which are not mapped and not in the target template are kept
+#   "rows": category -> {source element: target element} for the element based metadata files
+#           (the first column holds the metadata element, e.g. dataset_description)
+#   "identifiers": category -> the elements of the target template which list the related identifiers:
+#                  "identifier" and "relation" are the target elements holding the identifiers and their relation types,
+#                  "elements" is {source element: relation type}. Each source value is set in the value column prefilled
+#                  with its relation type, or in the first free value column
+#   "layout": source path -> target path for the other files and folders, relative to the dataset root
+#   "nested": file name -> category for the metadata files in the sub folders, e.g. primary/sub-1/manifest.xlsx
+#   "drop_template_rows": whether to drop the rows copied unchanged from the source template
+#                         (e.g. the description and the example rows of the version 1.2.3 templates)
+MIGRATIONS = {
+    ("1_2_3", "2_0_0"): {
+        "sheets": {
+            "dataset_description": "dataset_description",
+            "subjects": "subjects",
+            "samples": "samples",
+            "submission": "submission",
+        },
+        "columns": {
+            "dataset_description": {
+                "Additional Values": "Value n",
+            },
+            "subjects": {
+                "subject_id": "subject id",
+                "pool_id": "pool id",
+                "experimental group": "subject experimental group",
+                "Additional Fields (e.g. MINDS)": None,
+                "protocol.io location": "protocol url or doi",
+                "experimental log file name": "experimental log file path",
+            },
+            "samples": {
+                "subject_id": "subject id",
+                "sample_id": "sample id",
+                "wasDerivedFromSample": "was derived from",
+                "pool_id": "pool id",
+                "experimental group": "sample experimental group",
+                "specimen type": "sample type",
+                "specimen anatomical location": "sample anatomical location",
+                "Additional Fields (e.g. MINDS)": None,
+                "protocol.io location": "protocol url or doi",
+                "experimental log file name": "experimental log file path",
+            },
+            "manifest": {
+                "pattern": "filename",
+            },
+        },
+        "rows": {
+            "dataset_description": {
+                "Name": "    Title",
+                "Description": "    Subtitle",
+                "Keywords": "    Keywords",
+                "Funding": "    Funding",
+                "Acknowledgements": "    Acknowledgments",
+                "Title for complete data set": "    Study collection title",
+                "Contributors": "    Contributor name",
+                "Contributor ORCID ID": "    Contributor ORCiD",
+                "Contributor Affiliation": "    Contributor affiliation",
+                "Contributor Role": "    Contributor role",
+                "Number of subjects": "    Number of subjects",
+                "Number of samples": "    Number of samples",
+            },
+            "submission": {
+                "SPARC Award number": "SPARC award number",
+                "Milestone achieved": "Milestone achieved",
+                "Milestone completion date": "Milestone completion date",
+            },
+        },
+        "identifiers": {
+            "dataset_description": {
+                "identifier": "    Identifier",
+                "relation": "    Relation type",
+                "elements": {
+                    "Protocol URL or DOI": "HasProtocol",
+                    "Originating Article DOI": "IsDescribedBy",
+                },
+            },
+        },
+        "layout": {
+            "README": "README.md",
+        },
+        "nested": {
+            "manifest.xlsx": "manifest",
+        },
+        "drop_template_rows": True,
+    },
+}
+
+
+def register_migration(from_version, to_version, mapping):
+    """
+    Register a migration between two template versions
+
+    :param from_version: source template version, e.g. "1.2.3"
+    :type from_version: string
+    :param to_version: target template version, e.g. "2.0.0"
+    :type to_version: string
+    :param mapping: declarative mapping. See MIGRATIONS for the format
+    :type mapping: dict
+    """
+    dataset = Dataset()
+    key = (dataset._convert_version_format(from_version), dataset._convert_version_format(to_version))
+    MIGRATIONS[key] = mapping
+
+
+def get_migration(from_version, to_version):
+    """
+    Get the mapping between two template versions
+
+    :param from_version: source template version
+    :type from_version: string
+    :param to_version: target template version
+    :type to_version: string
+    :return: declarative mapping
+    :rtype: dict
+    """
+    dataset = Dataset()
+    key = (dataset._convert_version_format(from_version), dataset._convert_version_format(to_version))
+    mapping = MIGRATIONS.get(key)
+    if mapping is None:
+        msg = "Migration from version " + str(from_version) + " to " + str(to_version) + " is not supported."
+        raise ValueError(msg)
+
+    return mapping
+
+
+@lru_cache(maxsize=None)
+def _get_template_rows(path):
+    """
+    Get the rows of a template metadata file. Cached so each template is parsed only once per process
+
+    :param path: path to the template metadata file
+    :type path: string
+    :return: the rows of the template as tuples
+    :rtype: frozenset
+    """
+    if not Path(path).is_file():
+        return frozenset()
+
+    return frozenset(tuple(row.items()) for row in iter_excel_rows(path))
+
+
+@lru_cache(maxsize=None)
+def _get_template_header(path):
+    """
+    Get the column names of a template metadata file. Cached so each template is parsed only once per process
+
+    :param path: path to the template metadata file
+    :type path: string
+    :return: column names
+    :rtype: tuple
+    """
+    return tuple(name for name in read_excel_header(path) if name is not None)
+
+
+def _migrate_table(source_path, target_path, template_path, source_template_path, columns, drop_template_rows):
+    """
+    Migrate a row based metadata file (e.g. subjects) by streaming its rows
+
+    :param source_path: path to the source metadata file
+    :type source_path: Path
+    :param target_path: path to the migrated metadata file
+    :type target_path: Path
+    :param template_path: path to the target template metadata file
+    :type template_path: Path
+    :param source_template_path: path to the source template metadata file
+    :type source_template_path: Path
+    :param columns: {source column: target column} mapping
+    :type columns: dict
+    :param drop_template_rows: whether to drop the rows copied unchanged from the source template
+    :type drop_template_rows: bool
+    :return: number of migrated rows
+    :rtype: int
+    """
+    source_columns = [name for name in read_excel_header(source_path) if name is not None]
+    target_columns = list(_get_template_header(str(template_path))) if template_path.is_file() else list()
+
+    for column in source_columns:
+        name = columns.get(column, column)
+        if name is not None and name not in target_columns:
+            target_columns.append(name)
+
+    template_rows = _get_template_rows(str(source_template_path)) if drop_template_rows else frozenset()
+
+    def rows():
+        for row in iter_excel_rows(source_path):
+            if tuple(row.items()) in template_rows:
+                continue
+            migrated = dict()
+            for column, value in row.items():
+                name = columns.get(column, column)
+                if name is not None:
+                    migrated[name] = value
+            yield migrated
+
+    return write_excel_rows(target_path, rows(), columns=target_columns, template_path=template_path)
+
+
+def _migrate_elements(source_path, target_path, template_path, source_template_path, columns, elements,
+                      identifiers=None):
+    """
+    Migrate an element based metadata file (e.g. dataset_description) into the target template.
+    The file is small, so it is written with the styles of the template like Dataset.save
+
+    :param source_path: path to the source metadata file
+    :type source_path: Path
+    :param target_path: path to the migrated metadata file
+    :type target_path: Path
+    :param template_path: path to the target template metadata file
+    :type template_path: Path
+    :param source_template_path: path to the source template metadata file
+    :type source_template_path: Path
+    :param columns: {source column: target column} mapping for the value columns
+    :type columns: dict
+    :param elements: {source element: target element} mapping
+    :type elements: dict
+    :param identifiers: (optional) the elements of the target template which list the related identifiers.
+                        See MIGRATIONS for the format
+    :type identifiers: dict
+    :return: number of migrated values, and the values which could not be migrated ({source element: [values]})
+    :rtype: tuple
+    """
+    source = pd.concat(list(iter_excel_rows(source_path, chunksize=1000)) or [pd.DataFrame()])
+    target = Dataset()._read_metadata(template_path)
+    if source.empty or target.empty:
+        shutil.copyfile(str(template_path), str(target_path))
+        return 0, dict()
+
+    source_key = source.columns[0]
+    target_key = target.columns[0]
+    value_columns = [column for column in source.columns
+                     if column not in (source_key, "Description", "Definition", "Example")]
+    target_value_columns = [column for column in target.columns
+                            if column not in (target_key, "Description", "Definition", "Example")]
+    identifiers = identifiers or dict()
+    relations = identifiers.get("elements", dict())
+
+    # the values of the source template, e.g. the metadata version, are not reported as dropped
+    template_values = dict()
+    for row in _get_template_rows(str(source_template_path)):
+        row = dict(row)
+        template_values[row.get(source_key)] = [row.get(column) for column in value_columns
+                                                if not pd.isnull(row.get(column))]
+
+    def _get_row(element):
+        index = target.index[target[target_key] == element]
+        return None if index.empty else index[0]
+
+    def _set_identifier(value, relation):
+        identifier_row = _get_row(identifiers.get("identifier"))
+        relation_row = _get_row(identifiers.get("relation"))
+        if identifier_row is None or relation_row is None:
+            return False
+        free = [column for column in target_value_columns if pd.isnull(target.at[identifier_row, column])]
+        # prefer the column prefilled with the relation type, e.g. "HasProtocol" for the protocols
+        candidates = [column for column in free if target.at[relation_row, column] == relation] + \
+                     [column for column in free if pd.isnull(target.at[relation_row, column])]
+        if not candidates:
+            return False
+        target.at[identifier_row, candidates[0]] = value
+        target.at[relation_row, candidates[0]] = relation
+        return True
+
+    count = 0
+    dropped = dict()
+    for index, row in source.iterrows():
+        values = [(column, row[column]) for column in value_columns if not pd.isnull(row[column])]
+        if not values:
+            continue
+
+        element = elements.get(row[source_key])
+        target_index = target.index[target[target_key] == element] if element is not None else None
+        remaining = list()
+        if target_index is not None and not target_index.empty:
+            for column, value in values:
+                name = columns.get(column, column)
+                if name in target.columns:
+                    target.loc[target_index, name] = value
+                    count += 1
+                else:
+                    remaining.append(value)
+        elif row[source_key] in relations:
+            for column, value in values:
+                if _set_identifier(value, relations.get(row[source_key])):
+                    count += 1
+                else:
+                    remaining.append(value)
+        elif [value for column, value in values] != template_values.get(row[source_key]):
+            remaining = [value for column, value in values]
+
+        if remaining:
+            dropped[row[source_key]] = remaining
+
+    _write_workbook(template_path, target, str(target_path))
+
+    return count, dropped
+
+
+def _copy(source, target, ignore=None):
+    """
+    Copy a file or a folder
+
+    :param source: source path
+    :type source: Path
+    :param target: destination path
+    :type target: Path
+    :param ignore: (optional) file name patterns not to copy from the folders
+    :type ignore: list
+    """
+    if source.is_dir():
+        shutil.copytree(str(source), str(target), ignore=shutil.ignore_patterns(*ignore) if ignore else None)
+    else:
+        target.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(str(source), str(target))
+
+
+def _write_migration(dataset_dir, save_dir, source_template_dir, target_template_dir, mapping):
+    """
+    Write the migrated dataset into an empty folder
+
+    :param dataset_dir: path to the source dataset
+    :type dataset_dir: Path
+    :param save_dir: path to the migrated dataset
+    :type save_dir: Path
+    :param source_template_dir: path to the source template dataset
+    :type source_template_dir: Path
+    :param target_template_dir: path to the target template dataset
+    :type target_template_dir: Path
+    :param mapping: declarative mapping
+    :type mapping: dict
+    :return: migration report. See migrate_dataset
+    :rtype: dict
+    """
+    dataset = Dataset()
+    extension = dataset._metadata_extensions[0]
+
+    sheets = mapping.get("sheets", dict())
+    columns = mapping.get("columns", dict())
+    rows = mapping.get("rows", dict())
+    identifiers = mapping.get("identifiers", dict())
+    layout = mapping.get("layout", dict())
+    nested = mapping.get("nested", dict())
+    drop_template_rows = mapping.get("drop_template_rows", False)
+
+    report = {"counts": dict(), "dropped": dict()}
+
+    for path in sorted(dataset_dir.iterdir()):
+        if path.suffix in dataset._metadata_extensions:
+            category = sheets.get(path.stem, path.stem)
+            target_path = save_dir / (category + extension)
+            template_path = target_template_dir / (category + extension)
+            if category in rows:
+                count, dropped = _migrate_elements(path, target_path, template_path, source_template_dir / path.name,
+                                                   columns.get(path.stem, dict()), rows.get(category),
+                                                   identifiers.get(category))
+                if dropped:
+                    report["dropped"][path.name] = dropped
+            else:
+                count = _migrate_table(path, target_path, template_path, source_template_dir / path.name,
+                                       columns.get(path.stem, dict()), drop_template_rows)
+            report["counts"][target_path.name] = count
+        else:
+            # the nested metadata files are migrated below
+            _copy(path, save_dir / layout.get(path.name, path.name), ignore=list(nested))
+
+    # migrate the metadata files in the sub folders, e.g. primary/sub-1/manifest.xlsx
+    for filename, category in nested.items():
+        template_path = target_template_dir / (category + extension)
+        for path in sorted(dataset_dir.glob("*/**/" + filename)):
+            relative_path = path.relative_to(dataset_dir)
+            top = relative_path.parts[0]
+            target_path = save_dir / layout.get(top, top) / Path(*relative_path.parts[1:])
+            count = _migrate_table(path, target_path, template_path, source_template_dir / relative_path,
+                                   columns.get(category, dict()), drop_template_rows)
+            report["counts"][str(relative_path)] = count
+
+    # create the metadata files which are new in the target template
+    for template_path in sorted(target_template_dir.iterdir()):
+        target_path = save_dir / template_path.name
+        if template_path.suffix in dataset._metadata_extensions and not target_path.exists():
+            shutil.copyfile(str(template_path), str(target_path))
+
+    return report
+
+
+def migrate_dataset(dataset_dir, save_dir, from_version="1.2.3", to_version="2.0.0", mapping=None):
+    """
+    Migrate a dataset from one template version to another.
+    The row based metadata files are streamed row by row, the element based ones (e.g. dataset_description) are written
+    with the styles of the target template, and the other files are copied as they are.
+
+    The dataset is migrated into a staging folder next to save_dir, which is renamed into place once the migration
+    succeeded. If the migration fails, the staging folder is removed, so it can be run again.
+
+    :param dataset_dir: path to the source dataset
+    :type dataset_dir: string
+    :param save_dir: path to the migrated dataset. It should not exist yet
+    :type save_dir: string
+    :param from_version: source template version
+    :type from_version: string
+    :param to_version: target template version
+    :type to_version: string
+    :param mapping: (optional) declarative mapping. Defaults to the registered migration. See MIGRATIONS for the format
+    :type mapping: dict
+    :return: report with the "counts" (number of migrated rows or values for each metadata file) and
+             the "dropped" ({metadata file: {element: [values]}} for the values without a target element) keys
+    :rtype: dict
+    """
+    dataset = Dataset()
+    if mapping is None:
+        mapping = get_migration(from_version, to_version)
+
+    dataset_dir = Path(dataset_dir)
+    save_dir = Path(save_dir).absolute()
+    if not dataset_dir.is_dir():
+        msg = "Dataset not found: " + str(dataset_dir)
+        raise ValueError(msg)
+    if save_dir.exists():
+        msg = "Output path already exists: " + str(save_dir)
+        raise ValueError(msg)
+
+    source_template_dir = dataset._get_template_dir(dataset._convert_version_format(from_version))
+    target_template_dir = dataset._get_template_dir(dataset._convert_version_format(to_version))
+
+    # the staging folder is in the parent of save_dir, on the same filesystem, so it can be renamed into place
+    save_dir.parent.mkdir(parents=True, exist_ok=True)
+    staging_root = Path(tempfile.mkdtemp(prefix="." + save_dir.name + ".", dir=str(save_dir.parent)))
+    try:
+        staging_dir = staging_root / save_dir.name
+        staging_dir.mkdir()
+        report = _write_migration(dataset_dir, staging_dir, source_template_dir, target_template_dir, mapping)
+        os.rename(str(staging_dir), str(save_dir))
+    finally:
+        shutil.rmtree(str(staging_root), ignore_errors=True)
+
+    return report
+
+
+def _migrate_dataset(dataset_dir, save_dir, from_version, to_version, mapping):
+    """
+    Migrate a dataset in a worker process
+
+    :param dataset_dir: path to the source dataset
+    :type dataset_dir: string
+    :param save_dir: path to the migrated dataset
+    :type save_dir: string
+    :param from_version: source template version
+    :type from_version: string
+    :param to_version: target template version
+    :type to_version: string
+    :param mapping: declarative mapping
+    :type mapping: dict
+    :return: result with the "path", "status", "result" (the migration report), "error" and "duration" keys
+    :rtype: dict
+    """
+    start = time.time()
+    result = {"path": dataset_dir, "status": "succeeded", "result": None, "error": None}
+    try:
+        result["result"] = migrate_dataset(dataset_dir, save_dir, from_version, to_version, mapping)
+    except Exception as e:
+        result["status"] = "failed"
+        result["error"] = str(e)
+        result["traceback"] = traceback.format_exc()
+
+    result["duration"] = time.time() - start
+
+    return result
+
+
+def _get_output_paths(dataset_dirs):
+    """
+    Get the output path of each dataset relative to the output folder: its path relative to the common folder of
+    the parent folders of the datasets, so datasets with the same folder name are not saved to the same place
+
+    :param dataset_dirs: paths to the dataset directories
+    :type dataset_dirs: list
+    :return: (dataset directory, relative output path) pairs
+    :rtype: list
+    """
+    if not dataset_dirs:
+        return list()
+
+    paths = [Path(os.path.abspath(path)) for path in dataset_dirs]
+    root = Path(os.path.commonpath([str(path.parent) for path in paths]))
+
+    outputs = list()
+    used = dict()
+    for dataset_dir, path in zip(dataset_dirs, paths):
+        output = path.relative_to(root)
+        if output in used:
+            msg = "Datasets " + str(used[output]) + " and " + str(dataset_dir) + " have the same output path: " + \
+                  str(output)
+            raise ValueError(msg)
+        used[output] = dataset_dir
+        outputs.append((dataset_dir, output))
+
+    return outputs
+
+
+def migrate_datasets(dataset_dirs, save_dir, from_version="1.2.3", to_version="2.0.0", mapping=None,
+                     max_workers=None, progress=None):
+    """
+    Migrate many datasets in a process pool. Each dataset is saved to save_dir/<dataset path relative to the common folder
+    of the parent folders of the datasets>, e.g. "/archive/a/dataset" and "/archive/b/dataset" are saved to
+    save_dir/a/dataset and save_dir/b/dataset
+
+    :param dataset_dirs: a list of dataset directories, or a glob pattern e.g. "/archive/*/dataset"
+    :type dataset_dirs: list or string
+    :param save_dir: path to the output folder
+    :type save_dir: string
+    :param from_version: source template version
+    :type from_version: string
+    :param to_version: target template version
+    :type to_version: string
+    :param mapping: (optional) declarative mapping. Defaults to the registered migration
+    :type mapping: dict
+    :param max_workers: (optional) number of worker processes. Defaults to the number of CPUs
+    :type max_workers: int
+    :param progress: (optional) a function called with (completed, total, result) each time a dataset is migrated
+    :type progress: function
+    :return: summary with the "total", "succeeded", "failed", "duration", "failures" ({path: error}) and "results" keys
+    :rtype: dict
+    """
+    if mapping is None:
+        mapping = get_migration(from_version, to_version)
+
+    save_dir = Path(save_dir)
+    tasks = [(path, str(save_dir / output), from_version, to_version, mapping)
+             for path, output in _get_output_paths(find_datasets(dataset_dirs))]
+
+    return run_tasks(_migrate_dataset, tasks, max_workers=max_workers, progress=progress)
@@ -0,0 +1,197 @@
+import operator
+import re
+from collections import OrderedDict
+
+import pandas as pd
+
+# SPARC id columns used to join the metadata categories, in order of priority: the most specific id first.
+# The underscore spellings are used by the version 1.2.3 templates
+SPARC_ID_COLUMNS = [
+    "performance id",
+    "sample id", "sample_id",
+    "subject id", "subject_id",
+    "pool id", "pool_id"
+]
+
+# The manifest has no id columns. The ids are derived from the folders in its file paths,
+# e.g. "primary/sub-1/sam-1/image.dcm" or "primary/sub-1/perf-1/recording.csv". {id column: folder prefix}
+PATH_COLUMN = "filename"
+PATH_ID_COLUMNS = OrderedDict([
+    ("subject id", "sub-"),
+    ("sample id", "sam-"),
+    ("performance id", "perf-")
+])
+
+OPERATORS = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "in": lambda value, operand: value in operand,
+    "not in": lambda value, operand: value not in operand,
+    "contains": lambda value, operand: str(operand) in str(value),
+}
+
+
+def _to_number(value):
+    """
+    Convert a value to a number if possible
+
+    :param value: cell value
+    :type value: object
+    :return: the value as a float, or the value itself if it is not numeric
+    :rtype: object
+    """
+    if isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            return value
+    return value
+
+
+def match(value, op, operand):
+    """
+    Check whether a cell value matches a filter. Empty cells never match, except for "!=" and "not in".
+    Strings are compared as numbers when the operand is a number, e.g. "55" > 50
+
+    :param value: cell value
+    :type value: object
+    :param op: one of "==", "!=", "<", "<=", ">", ">=", "in", "not in", "contains" or a callable taking (value, operand)
+    :type op: string
+    :param operand: the value to compare against
+    :type operand: object
+    :return: True if the value matches the filter
+    :rtype: bool
+    """
+    if callable(op):
+        compare = op
+    else:
+        compare = OPERATORS.get(op)
+        if compare is None:
+            msg = "Unknown operator: " + str(op) + ". Use one of: " + ", ".join(OPERATORS)
+            raise ValueError(msg)
+
+    if value is None or (not isinstance(value, str) and pd.isnull(value)):
+        return op in ("!=", "not in")
+
+    if isinstance(operand, (int, float)) and not isinstance(operand, bool):
+        value = _to_number(value)
+
+    try:
+        return bool(compare(value, operand))
+    except TypeError:
+        return False
+
+
+def match_row(row, filters):
+    """
+    Check whether a row matches all the filters
+
+    :param row: a row in the dictionary format
+    :type row: dict
+    :param filters: a list of (column, operator, value) filters
+    :type filters: list
+    :return: True if the row matches all the filters
+    :rtype: bool
+    """
+    return all(match(row.get(column), op, operand) for column, op, operand in filters)
+
+
+def filter_frame(metadata, filters):
+    """
+    Select the rows of a DataFrame that match all the filters
+
+    :param metadata: metadata
+    :type metadata: Pandas.DataFrame
+    :param filters: a list of (column, operator, value) filters
+    :type filters: list
+    :return: the matching rows
+    :rtype: Pandas.DataFrame
+    """
+    if not filters:
+        return metadata
+
+    mask = pd.Series(True, index=metadata.index)
+    for column, op, operand in filters:
+        mask &= metadata[column].map(lambda value: match(value, op, operand)).astype(bool)
+
+    return metadata[mask]
+
+
+def get_path_id(path, prefix):
+    """
+    Get the SPARC id in a file path
+
+    :param path: file path relative to the dataset, e.g. "primary/sub-1/sam-1/image.dcm"
+    :type path: string
+    :param prefix: prefix of the id folder, e.g. "sam-"
+    :type prefix: string
+    :return: the name of the first folder with the prefix, e.g. "sam-1", or None
+    :rtype: string
+    """
+    if not isinstance(path, str):
+        return None
+
+    for part in re.split(r"[\\/]", path)[:-1]:
+        if part.startswith(prefix):
+            return part
+
+    return None
+
+
+def get_path_id_columns(columns):
+    """
+    Get the SPARC id columns which can be derived from the file paths of a category
+
+    :param columns: columns of the category
+    :type columns: list
+    :return: the id columns which are not in the category but can be derived from its "filename" column
+    :rtype: list
+    """
+    if PATH_COLUMN not in columns:
+        return list()
+
+    return [column for column in PATH_ID_COLUMNS if column not in columns]
+
+
+def add_path_ids(metadata, columns):
+    """
+    Add SPARC id columns derived from the file paths
+
+    :param metadata: metadata with a "filename" column, e.g. the manifest
+    :type metadata: Pandas.DataFrame
+    :param columns: the id columns to add. See get_path_id_columns
+    :type columns: list
+    :return: the metadata with the id columns
+    :rtype: Pandas.DataFrame
+    """
+    if not columns:
+        return metadata
+
+    metadata = metadata.copy()
+    for column in columns:
+        prefix = PATH_ID_COLUMNS[column]
+        metadata[column] = metadata[PATH_COLUMN].map(lambda path: get_path_id(path, prefix))
+
+    return metadata
+
+
+def find_join_key(left_columns, right_columns):
+    """
+    Find the SPARC id column to join two categories on
+
+    :param left_columns: columns of the left category
+    :type left_columns: list
+    :param right_columns: columns of the right category
+    :type right_columns: list
+    :return: the join column, or None if the categories do not share an id column
+    :rtype: string
+    """
+    for column in SPARC_ID_COLUMNS:
+        if column in left_columns and column in right_columns:
+            return column
+
+    return None
@@ -0,0 +1,337 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+# inotify flags, see <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+EVENT_BUFFER_SIZE = 64 * 1024
+# struct inotify_event: wd, mask, cookie, len, followed by the name
+EVENT_HEADER = struct.Struct("iIII")
+# time without file events before the changed files are read, so files which are being written are not read
+SETTLE_TIME = 0.2
+
+
+class _Inotify(object):
+    """
+    Minimal inotify wrapper (Linux only) used to wake up the watcher when files change in a folder
+    """
+
+    def __init__(self, path):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        # set when the watched folder is moved or deleted, e.g. replaced by an atomic save
+        self.lost = False
+
+        mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF | IN_MOVE_SELF
+        if libc.inotify_add_watch(self._fd, str(path).encode(), mask) < 0:
+            os.close(self._fd)
+            raise OSError(ctypes.get_errno(), "inotify_add_watch failed")
+
+    def wait(self, timeout):
+        """
+        Wait for file events
+
+        :param timeout: maximum time to wait in seconds
+        :type timeout: float
+        :return: True if files changed
+        :rtype: bool
+        """
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return False
+
+        # drain the pending events. Which files changed is checked from their mtime and size
+        data = b""
+        try:
+            while True:
+                chunk = os.read(self._fd, EVENT_BUFFER_SIZE)
+                if not chunk:
+                    break
+                data += chunk
+        except BlockingIOError:
+            pass
+
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                self.lost = True
+            offset += EVENT_HEADER.size + length
+
+        return True
+
+    def close(self):
+        """
+        Stop watching
+        """
+        os.close(self._fd)
+
+
+class DatasetWatcher(object):
+    """
+    Watch the metadata files of a loaded dataset and reload the files which are changed on disk, e.g. by hand in Excel.
+    Uses inotify on Linux and falls back to polling elsewhere.
+
+    Only the metadata files whose modification time or size changed are read again.
+    A metadata file changed on disk while its category has unsaved changes in memory (from set_field/append)
+    is a conflict: the in-memory changes are kept, unless reload_conflicts is True.
+
+    The reloads happen in a background thread. Hold watcher.lock to use the dataset without being interrupted by a reload.
+    """
+
+    def __init__(self, dataset, callback=None, conflict_callback=None, reload_conflicts=False, interval=1.0,
+                 use_inotify=True):
+        """
+        :param dataset: the loaded dataset to watch
+        :type dataset: Dataset
+        :param callback: (optional) a function called with the list of the reloaded categories
+        :type callback: function
+        :param conflict_callback: (optional) a function called with the list of the categories changed on disk
+                                  while they have unsaved changes in memory
+        :type conflict_callback: function
+        :param reload_conflicts: (optional) if True, conflicting categories are reloaded and the in-memory changes are lost
+        :type reload_conflicts: bool
+        :param interval: (optional) polling interval in seconds
+        :type interval: float
+        :param use_inotify: (optional) whether to use inotify when available
+        :type use_inotify: bool
+        """
+        dataset_path = Path(dataset.get_dataset_path())
+        if not dataset_path.is_dir():
+            msg = "Only datasets loaded from a directory can be watched: " + str(dataset_path)
+            raise ValueError(msg)
+
+        self.lock = threading.RLock()
+        self._dataset = dataset
+        self._dataset_path = dataset_path
+        self._callback = callback
+        self._conflict_callback = conflict_callback
+        self._reload_conflicts = reload_conflicts
+        self._interval = interval
+        self._use_inotify = use_inotify and sys.platform.startswith("linux")
+
+        self._signatures = {path: self._get_signature(path) for path in self._list_metadata_files()}
+        self._pending = set()
+        self._conflicts = set()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def _list_metadata_files(self):
+        """
+        List the metadata files of the dataset
+
+        :return: paths to the metadata files
+        :rtype: list
+        """
+        paths = list()
+        if not self._dataset_path.is_dir():
+            # the folder is being replaced, e.g. by an atomic save
+            return paths
+
+        for path in self._dataset_path.iterdir():
+            # skip the lock files of the spreadsheet editors, e.g. ~$subjects.xlsx
+            if path.suffix in self._dataset._metadata_extensions and not path.name.startswith(("~$", ".")):
+                paths.append(path)
+
+        return paths
+
+    @staticmethod
+    def _get_signature(path):
+        """
+        Get the modification time and size of a file
+
+        :param path: path to the file
+        :type path: Path
+        :return: (mtime, size), or None if the file does not exist
+        :rtype: tuple
+        """
+        try:
+            stat = path.stat()
+        except OSError:
+            return None
+
+        return stat.st_mtime_ns, stat.st_size
+
+    def watches(self, path):
+        """
+        Check whether a folder is the watched dataset folder
+
+        :param path: path to a folder
+        :type path: string
+        :return: True if the folder is watched
+        :rtype: bool
+        """
+        return os.path.realpath(str(path)) == os.path.realpath(str(self._dataset_path))
+
+    @contextmanager
+    def ignore_changes(self):
+        """
+        Context manager holding the watcher lock while the dataset writes its own metadata files, e.g. in Dataset.save.
+        The files written inside the context are not reloaded nor reported as conflicts
+        """
+        with self.lock:
+            signatures = {path: self._get_signature(path) for path in self._list_metadata_files()}
+            try:
+                yield self
+            finally:
+                for path in self._list_metadata_files():
+                    signature = self._get_signature(path)
+                    if signature != signatures.get(path):
+                        self._signatures[path] = signature
+                        self._pending.discard(path)
+
+    def poll(self):
+        """
+        Check the metadata files once and reload the changed ones
+
+        :return: the reloaded categories
+        :rtype: list
+        """
+        reloaded = list()
+        conflicts = list()
+        with self.lock:
+            # the files are checked while holding the lock, so the files written by a save are not seen half way
+            changed = list()
+            for path in self._list_metadata_files():
+                signature = self._get_signature(path)
+                if signature is not None and (signature != self._signatures.get(path) or path in self._pending):
+                    changed.append((path, signature))
+
+            # conflicts are reported once, until the category is saved or reloaded
+            self._conflicts &= self._dataset._modified
+            for path, signature in changed:
+                category = path.stem
+                if category in self._dataset._modified:
+                    if category not in self._conflicts:
+                        conflicts.append(category)
+                        self._conflicts.add(category)
+                    if not self._reload_conflicts:
+                        self._signatures[path] = signature
+                        continue
+
+                try:
+                    metadata = self._dataset._read_metadata(path)
+                except Exception:
+                    # the file may still be being written. try again at the next check
+                    self._pending.add(path)
+                    continue
+
+                value = self._dataset._dataset.get(category)
+                if isinstance(value, dict):
+                    value["path"] = path
+                    value["metadata"] = metadata
+                    if value.get("compact"):
+                        self._dataset._compact_entry(value)
+                else:
+                    self._dataset._dataset[category] = {"path": path, "metadata": metadata}
+
+                self._dataset._modified.discard(category)
+                self._dataset._shared.discard(category)
+                self._pending.discard(path)
+                self._signatures[path] = signature
+                reloaded.append(category)
+
+            if reloaded:
+                self._dataset._clear_cache()
+
+        if conflicts and self._conflict_callback:
+            self._conflict_callback(conflicts)
+        if reloaded and self._callback:
+            self._callback(reloaded)
+
+        return reloaded
+
+    def _open_inotify(self):
+        """
+        Watch the dataset folder with inotify
+
+        :return: the inotify watch, or None to poll the folder
+        :rtype: _Inotify
+        """
+        if not self._use_inotify:
+            return None
+
+        try:
+            return _Inotify(self._dataset_path)
+        except (OSError, AttributeError):
+            return None
+
+    def _run(self):
+        """
+        Watch the dataset until stop is called
+        """
+        inotify = self._open_inotify()
+
+        try:
+            while not self._stop.is_set():
+                if inotify is not None:
+                    changed = inotify.wait(self._interval)
+                    while changed and inotify.wait(SETTLE_TIME) and not self._stop.is_set():
+                        pass
+                    if inotify.lost:
+                        # the watched folder was replaced, e.g. by an atomic save: watch the folder now at the dataset path.
+                        # if it can not be watched yet, poll until it can
+                        inotify.close()
+                        inotify = self._open_inotify()
+                    elif not changed and not self._pending:
+                        continue
+                else:
+                    self._stop.wait(self._interval)
+                    if self._use_inotify and not self._stop.is_set():
+                        inotify = self._open_inotify()
+                if not self._stop.is_set():
+                    self.poll()
+        finally:
+            if inotify is not None:
+                inotify.close()
+
+    def start(self):
+        """
+        Start watching the dataset in a background thread
+
+        :return: the watcher
+        :rtype: DatasetWatcher
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return self
+
+        self._stop.clear()
+        if self not in self._dataset._watchers:
+            self._dataset._watchers.append(self)
+        self._thread = threading.Thread(target=self._run, name="DatasetWatcher", daemon=True)
+        self._thread.start()
+
+        return self
+
+    def stop(self):
+        """
+        Stop watching the dataset
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self in self._dataset._watchers:
+            self._dataset._watchers.remove(self)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
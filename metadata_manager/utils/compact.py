@@ -0,0 +1,149 @@
+import sys
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_categorical_dtype, is_float_dtype, is_integer_dtype, is_numeric_dtype, is_object_dtype
+
+# maximum ratio of unique values to rows for a text column to be stored as categorical
+CATEGORY_RATIO = 0.5
+
+
+def _intern(value):
+    """
+    Intern a string so repeated values share a single object
+
+    :param value: cell value
+    :type value: object
+    :return: the interned string, or the value unchanged if it is not a string
+    :rtype: object
+    """
+    return sys.intern(value) if type(value) is str else value
+
+
+def _downcast(series):
+    """
+    Downcast a numeric column to the smallest type which holds its values exactly
+
+    :param series: numeric column
+    :type series: Pandas.Series
+    :return: the downcast column, or the column unchanged
+    :rtype: Pandas.Series
+    """
+    if is_integer_dtype(series):
+        return pd.to_numeric(series, downcast="integer")
+
+    if is_float_dtype(series) and series.dtype != np.float32:
+        downcast = series.astype(np.float32)
+        # only keep float32 if no value is rounded, so the saved values are unchanged
+        if ((downcast.astype(series.dtype) == series) | series.isnull()).all():
+            return downcast
+
+    return series
+
+
+def compact_frame(metadata, category_ratio=CATEGORY_RATIO):
+    """
+    Convert metadata to a compact representation: text columns with repeated values are stored as categorical,
+    the other strings are interned, numeric columns are downcast and the empty columns are dropped
+
+    :param metadata: metadata
+    :type metadata: Pandas.DataFrame
+    :param category_ratio: (optional) maximum ratio of unique values to rows for a text column to be stored as categorical
+    :type category_ratio: float
+    :return: the compact metadata, and the original columns and dtypes needed to convert it back
+    :rtype: tuple
+    """
+    info = {
+        "columns": list(metadata.columns),
+        "dtypes": {column: str(dtype) for column, dtype in metadata.dtypes.items()}
+    }
+
+    empty = [column for column in metadata.columns if metadata[column].isnull().all()]
+    metadata = metadata.drop(columns=empty)
+
+    columns = dict()
+    for column in metadata.columns:
+        series = metadata[column]
+        if is_object_dtype(series):
+            values = series.dropna()
+            if values.nunique() <= len(values) * category_ratio:
+                series = series.astype("category")
+            else:
+                series = series.map(_intern)
+        else:
+            series = _downcast(series)
+        columns[column] = series
+
+    return pd.DataFrame(columns, index=metadata.index, columns=metadata.columns), info
+
+
+def expand_frame(metadata, info):
+    """
+    Convert compact metadata back to its original columns and dtypes
+
+    :param metadata: compact metadata
+    :type metadata: Pandas.DataFrame
+    :param info: the original columns and dtypes returned by compact_frame
+    :type info: dict
+    :return: the metadata with the original columns and dtypes. Columns added since compact_frame are kept at the end
+    :rtype: Pandas.DataFrame
+    """
+    metadata = metadata.reindex(columns=get_columns(metadata, info))
+
+    for column, dtype in info.get("dtypes").items():
+        series = metadata[column]
+        if str(series.dtype) == dtype:
+            continue
+
+        if is_categorical_dtype(series):
+            series = series.astype(object)
+        if str(series.dtype) != dtype:
+            try:
+                series = series.astype(dtype)
+            except (TypeError, ValueError):
+                # the values changed since compact_frame, e.g. text set in a numeric column
+                pass
+        metadata[column] = series
+
+    return metadata
+
+
+def get_columns(metadata, info):
+    """
+    Get the original columns of compact metadata
+
+    :param metadata: compact metadata
+    :type metadata: Pandas.DataFrame
+    :param info: the original columns and dtypes returned by compact_frame
+    :type info: dict
+    :return: the original columns, followed by the columns added since compact_frame
+    :rtype: list
+    """
+    columns = list(info.get("columns"))
+
+    return columns + [column for column in metadata.columns if column not in columns]
+
+
+def prepare_column(metadata, column, value, info):
+    """
+    Prepare a column of compact metadata to be set to a value: a new value is added to the categories of
+    a categorical column, and a downcast column is converted back to its original dtype
+
+    :param metadata: compact metadata
+    :type metadata: Pandas.DataFrame
+    :param column: column name
+    :type column: string
+    :param value: the value to set
+    :type value: object
+    :param info: the original columns and dtypes returned by compact_frame
+    :type info: dict
+    """
+    if column not in metadata.columns:
+        return
+
+    series = metadata[column]
+    if is_categorical_dtype(series):
+        if not pd.isnull(value) and value not in series.cat.categories:
+            metadata[column] = series.cat.add_categories([value])
+    elif is_numeric_dtype(series) and str(series.dtype) != info.get("dtypes").get(column, str(series.dtype)):
+        metadata[column] = series.astype(info.get("dtypes").get(column))
@@ -0,0 +1,222 @@
+from copy import copy
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.utils import get_column_letter
+
+
+def _is_empty(value):
+    """
+    Check whether a cell value is empty
+
+    :param value: cell value
+    :type value: object
+    :return: True if the value is None or NaN
+    :rtype: bool
+    """
+    if value is None:
+        return True
+    try:
+        return bool(pd.isnull(value))
+    except (TypeError, ValueError):
+        return False
+
+
+def _to_frame(records, columns, index):
+    """
+    Convert a chunk of rows into a DataFrame. Empty cells are set to NaN as in pandas.read_excel
+
+    :param records: rows of cell values
+    :type records: list
+    :param columns: column names
+    :type columns: list
+    :param index: row index
+    :type index: list
+    :return: chunk of rows
+    :rtype: Pandas.DataFrame
+    """
+    records = [[np.nan if value is None else value for value in record] for record in records]
+
+    return pd.DataFrame(records, columns=columns, index=index)
+
+
+def read_excel_header(path):
+    """
+    Read the header (the first row) of an Excel file without loading the whole workbook
+
+    :param path: path to the Excel file, or a binary stream
+    :type path: string
+    :return: column names. Columns without a name are returned as None
+    :rtype: list
+    """
+    workbook = load_workbook(path if hasattr(path, "read") else str(path), read_only=True, data_only=True)
+    try:
+        worksheet = workbook.worksheets[0]
+        for row in worksheet.iter_rows(min_row=1, max_row=1, values_only=True):
+            return list(row)
+        return list()
+    finally:
+        workbook.close()
+
+
+def iter_excel_rows(path, columns=None, chunksize=None):
+    """
+    Iterate over the rows of an Excel file in openpyxl read-only mode.
+    Only one row (or one chunk of rows) is kept in memory at a time.
+
+    Rows are cleaned in the same way as Dataset._load:
+    empty rows are skipped and columns without a header are ignored.
+
+    :param path: path to the Excel file, or a binary stream
+    :type path: string
+    :param columns: (optional) names of the columns to return. Defaults to all the named columns
+    :type columns: list
+    :param chunksize: (optional) if provided, yield DataFrames with up to chunksize rows instead of single rows
+    :type chunksize: int
+    :return: an iterator of rows (dict) or DataFrame chunks. The row index follows the index used by Dataset._load,
+             i.e. the Excel row index - 2
+    :rtype: iterator
+    """
+    if chunksize is not None and (not isinstance(chunksize, int) or chunksize < 1):
+        msg = "chunksize should be a positive 'int'."
+        raise ValueError(msg)
+
+    workbook = load_workbook(path if hasattr(path, "read") else str(path), read_only=True, data_only=True)
+    try:
+        worksheet = workbook.worksheets[0]
+        rows = worksheet.iter_rows(values_only=True)
+
+        header = next(rows, None)
+        if header is None:
+            return
+
+        named = [(idx, name) for idx, name in enumerate(header) if name is not None]
+        if columns is None:
+            selected = named
+        else:
+            positions = {name: idx for idx, name in named}
+            missing = [column for column in columns if column not in positions]
+            if missing:
+                msg = "Column(s) not found: " + ", ".join(str(column) for column in missing)
+                raise ValueError(msg)
+            selected = [(positions[column], column) for column in columns]
+        names = [name for idx, name in selected]
+
+        index = list()
+        records = list()
+        for row_index, row in enumerate(rows):
+            if all(_is_empty(row[idx]) for idx, name in named if idx < len(row)):
+                continue
+
+            record = [row[idx] if idx < len(row) else None for idx, name in selected]
+
+            if chunksize is None:
+                yield dict(zip(names, record))
+                continue
+
+            index.append(row_index)
+            records.append(record)
+            if len(records) == chunksize:
+                yield _to_frame(records, names, index)
+                index = list()
+                records = list()
+
+        if records:
+            yield _to_frame(records, names, index)
+    finally:
+        workbook.close()
+
+
+def write_excel_rows(path, rows, columns=None, template_path=None, header=None):
+    """
+    Write rows to an Excel file in openpyxl write-only mode.
+    Rows are written as they are produced, so the whole category does not need to be kept in memory.
+
+    :param path: path to the output Excel file
+    :type path: string
+    :param rows: an iterable of rows (dict) and/or DataFrame chunks
+    :type rows: iterable
+    :param columns: (optional) column names. Defaults to the columns of the first chunk, or the keys of the first row
+    :type columns: list
+    :param template_path: (optional) path to a template Excel file. The style of the header cells and the column widths
+                          are copied from the template
+    :type template_path: string
+    :param header: (optional) column names written when rows is empty and columns is not provided.
+                   Defaults to the header of the template
+    :type header: list
+    :return: number of rows written
+    :rtype: int
+    """
+    header_styles = dict()
+    widths = dict()
+    if template_path and Path(template_path).is_file():
+        # the templates are small: the column widths are only available outside of the read-only mode
+        workbook = load_workbook(str(template_path))
+        try:
+            worksheet = workbook.worksheets[0]
+            for row in worksheet.iter_rows(min_row=1, max_row=1):
+                header_cells = [cell for cell in row if cell.value is not None]
+                header_styles = {cell.value: cell for cell in header_cells}
+                for cell in header_cells:
+                    dimension = worksheet.column_dimensions.get(cell.column_letter)
+                    if dimension is not None and dimension.width:
+                        widths[cell.value] = dimension.width
+                if header is None:
+                    header = [cell.value for cell in header_cells]
+        finally:
+            workbook.close()
+
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet()
+    header_written = False
+    count = 0
+
+    def _write_header(names):
+        # the column widths need to be set before the first row in the write-only mode
+        for position, name in enumerate(names, start=1):
+            if name in widths:
+                worksheet.column_dimensions[get_column_letter(position)].width = widths[name]
+
+        cells = list()
+        for name in names:
+            cell = WriteOnlyCell(worksheet, value=name)
+            template_cell = header_styles.get(name)
+            if template_cell is not None:
+                cell.font = copy(template_cell.font)
+                cell.fill = copy(template_cell.fill)
+                cell.border = copy(template_cell.border)
+                cell.alignment = copy(template_cell.alignment)
+            cells.append(cell)
+        worksheet.append(cells)
+
+    for item in rows:
+        if isinstance(item, pd.DataFrame):
+            if columns is None:
+                columns = list(item.columns)
+            records = (dict(zip(item.columns, values)) for values in item.itertuples(index=False, name=None))
+        else:
+            if columns is None:
+                columns = list(item.keys())
+            records = [item]
+
+        if not header_written:
+            _write_header(columns)
+            header_written = True
+
+        for record in records:
+            worksheet.append([None if _is_empty(record.get(name)) else record.get(name) for name in columns])
+            count += 1
+
+    if not header_written:
+        columns = columns or header
+        if not columns:
+            msg = "No columns to write: rows is empty and no header is available."
+            raise ValueError(msg)
+        _write_header(columns)
+
+    workbook.save(str(path))
+
+    return count
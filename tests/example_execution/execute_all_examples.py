@@ -32,7 +32,13 @@ example_root_directory = os.path.abspath('../../examples')
 # Note that some of these examples need to be run in order.
 example_list = [
     ['tutorial/', '.py', 'tutorial'],
-    ['tutorial/', '.ipynb', 'tutorial']
+    ['tutorial/', '.ipynb', 'tutorial'],
+    ['./', '.py', 'load_and_save'],
+    ['./', '.py', 'stream_rows'],
+    ['./', '.py', 'query_dataset'],
+    ['./', '.py', 'diff_datasets'],
+    ['./', '.py', 'batch_update'],
+    ['./', '.py', 'migrate_datasets']
 ]
 
 # Define the configuration for the examples.
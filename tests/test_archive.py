@@ -0,0 +1,115 @@
+"""Tests loading datasets from archives and saving them to folders and archives."""
+
+import io
+import shutil
+import tarfile
+import tempfile
+import unittest
+import zipfile
+from pathlib import Path
+
+from openpyxl.utils.exceptions import IllegalCharacterError
+
+from metadata_manager import Dataset
+from metadata_manager.core.archive import ArchiveReader, _is_safe
+
+
+def _add_tar_bytes(archive, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    archive.addfile(info, io.BytesIO(data))
+
+
+class TestArchive(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = Path(tempfile.mkdtemp())
+        self.dataset_dir = self.tmp_dir / "dataset"
+        Dataset().save_template(self.dataset_dir, version="2.0.0")
+        self.files = sorted(str(path.relative_to(self.dataset_dir)) for path in self.dataset_dir.rglob("*")
+                            if path.is_file())
+
+    def tearDown(self):
+        shutil.rmtree(str(self.tmp_dir))
+
+    def _make_zip(self, path, extra=None):
+        with zipfile.ZipFile(str(path), "w") as archive:
+            for name in self.files:
+                archive.write(str(self.dataset_dir / name), "dataset/" + name)
+            for name, data in (extra or dict()).items():
+                archive.writestr(name, data)
+
+    def _make_tar(self, path, extra=None):
+        with tarfile.open(str(path), "w:gz") as archive:
+            for name in self.files:
+                archive.add(str(self.dataset_dir / name), "dataset/" + name)
+            for name, data in (extra or dict()).items():
+                _add_tar_bytes(archive, name, data)
+
+    def test_is_safe(self):
+        self.assertTrue(_is_safe("dataset/primary/file.txt"))
+        self.assertTrue(_is_safe("dataset/..file"))
+        self.assertFalse(_is_safe("../x"))
+        self.assertFalse(_is_safe("dataset/../../x"))
+        self.assertFalse(_is_safe("..\\x"))
+        self.assertFalse(_is_safe("/etc/x"))
+        self.assertFalse(_is_safe("C:/x"))
+
+    def test_unsafe_members_are_skipped(self):
+        extra = {"../x": b"outside", "dataset/../../y": b"outside", "/abs": b"outside"}
+        for name, make in (("dataset.zip", self._make_zip), ("dataset.tar.gz", self._make_tar)):
+            archive_path = self.tmp_dir / name
+            make(archive_path, extra)
+
+            with ArchiveReader(archive_path) as reader:
+                names = [entry.name for entry in reader.entries()]
+            self.assertTrue(all(_is_safe(name) for name in names))
+
+            dataset = Dataset()
+            dataset.load_dataset(archive_path)
+            save_dir = self.tmp_dir / "out" / name / "dataset"
+            dataset.save(save_dir)
+
+            self.assertFalse((self.tmp_dir / "x").exists())
+            self.assertFalse((self.tmp_dir / "out" / name / "x").exists())
+            self.assertFalse((self.tmp_dir / "out" / "y").exists())
+            saved = sorted(str(path.relative_to(save_dir)) for path in save_dir.rglob("*") if path.is_file())
+            self.assertEqual(saved, self.files)
+
+    def test_save_over_itself(self):
+        for name, make in (("dataset.zip", self._make_zip), ("dataset.tar.gz", self._make_tar)):
+            archive_path = self.tmp_dir / name
+            make(archive_path)
+
+            dataset = Dataset()
+            dataset.load_dataset(archive_path)
+            dataset.set_field("dataset_description", 5, "Value", "Test Project")
+            dataset.save(archive_path)
+
+            dataset = Dataset()
+            dataset.load_dataset(archive_path)
+            metadata = dataset._dataset["dataset_description"]["metadata"]
+            self.assertEqual(metadata.loc[3, "Value"], "Test Project")
+            with ArchiveReader(archive_path) as reader:
+                saved = sorted(entry.name for entry in reader.entries() if not entry.is_dir)
+            self.assertEqual(saved, self.files)
+            self.assertEqual([path.name for path in self.tmp_dir.iterdir() if path.name.startswith(".")], list())
+
+    def test_failed_save_keeps_archive(self):
+        archive_path = self.tmp_dir / "dataset.zip"
+        self._make_zip(archive_path)
+        content = archive_path.read_bytes()
+
+        dataset = Dataset()
+        dataset.load_dataset(archive_path)
+        # a value which can not be written to Excel, so the save fails after the archive was opened for writing
+        dataset.set_field("dataset_description", 5, "Value", "illegal \x01 character")
+        with self.assertRaises(IllegalCharacterError):
+            dataset.save(archive_path)
+
+        self.assertEqual(archive_path.read_bytes(), content)
+        self.assertEqual([path.name for path in self.tmp_dir.iterdir() if path.name.startswith(".")], list())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+"""Tests saving datasets atomically with Dataset.save(save_dir, atomic=True)."""
+
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+from openpyxl.utils.exceptions import IllegalCharacterError
+
+from metadata_manager import Dataset
+
+
+def _read_files(directory):
+    return {str(path.relative_to(directory)): path.read_bytes() for path in Path(directory).rglob("*") if path.is_file()}
+
+
+class TestAtomicSave(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = Path(tempfile.mkdtemp())
+        self.dataset_dir = self.tmp_dir / "dataset"
+        Dataset().save_template(self.dataset_dir, version="2.0.0")
+        (self.dataset_dir / "notes.txt").write_text("kept")
+
+    def tearDown(self):
+        shutil.rmtree(str(self.tmp_dir))
+
+    def _staging_dirs(self):
+        return [path.name for path in self.tmp_dir.iterdir() if path.name.startswith(".")]
+
+    def test_save_over_itself(self):
+        dataset = Dataset()
+        dataset.load_dataset(self.dataset_dir)
+        dataset.set_field("dataset_description", 5, "Value", "Test Project")
+        dataset.save(self.dataset_dir, atomic=True, max_workers=2)
+
+        dataset = Dataset()
+        dataset.load_dataset(self.dataset_dir)
+        metadata = dataset._dataset["dataset_description"]["metadata"]
+        self.assertEqual(metadata.loc[3, "Value"], "Test Project")
+        self.assertEqual((self.dataset_dir / "notes.txt").read_text(), "kept")
+        self.assertEqual(self._staging_dirs(), list())
+
+    def test_failed_render_keeps_dest_dir(self):
+        files = _read_files(self.dataset_dir)
+
+        dataset = Dataset()
+        dataset.load_dataset(self.dataset_dir)
+        # a value which can not be written to Excel, so a worker fails to render the metadata file
+        dataset.set_field("dataset_description", 5, "Value", "illegal \x01 character")
+        with self.assertRaises(IllegalCharacterError):
+            dataset.save(self.dataset_dir, atomic=True, max_workers=2)
+
+        self.assertEqual(_read_files(self.dataset_dir), files)
+        self.assertEqual(self._staging_dirs(), list())
+
+    def test_save_to_another_dir_copies_files(self):
+        save_dir = self.tmp_dir / "copy"
+
+        dataset = Dataset()
+        dataset.load_dataset(self.dataset_dir)
+        dataset.save(save_dir, atomic=True, max_workers=2)
+
+        # the saved dataset does not share its files with the source dataset
+        with open(str(save_dir / "notes.txt"), "a") as f:
+            f.write(" changed")
+        self.assertEqual((self.dataset_dir / "notes.txt").read_text(), "kept")
+        self.assertEqual(self._staging_dirs(), list())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+"""Tests streaming the rows of metadata files with Dataset.iter_rows and Dataset.write_rows."""
+
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+from openpyxl import load_workbook
+
+from metadata_manager import Dataset
+from metadata_manager.utils.streaming import read_excel_header
+
+
+class TestStreaming(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = Path(tempfile.mkdtemp())
+        self.dataset_dir = self.tmp_dir / "dataset"
+        self.dataset = Dataset()
+        self.dataset.save_template(self.dataset_dir, version="2.0.0")
+        self.dataset.set_dataset_path(self.dataset_dir)
+        self.dataset.set_version("2.0.0")
+
+    def tearDown(self):
+        shutil.rmtree(str(self.tmp_dir))
+
+    def test_round_trip_keeps_user_columns(self):
+        header = read_excel_header(self.dataset_dir / "manifest.xlsx")
+        rows = [
+            {"filename": "sub-1/sam-1/file_" + str(idx) + ".txt", "file type": "txt", "my extra": idx}
+            for idx in range(5)
+        ]
+        self.dataset.write_rows("manifest", rows, self.dataset_dir,
+                                columns=[name for name in header if name is not None] + ["my extra"])
+        expected = list(self.dataset.iter_rows("manifest"))
+
+        # identity round trip in chunks
+        chunks = self.dataset.iter_rows("manifest", chunksize=2)
+        self.dataset.write_rows("manifest", chunks, self.dataset_dir)
+
+        self.assertEqual(list(self.dataset.iter_rows("manifest")), expected)
+        self.assertIn("my extra", read_excel_header(self.dataset_dir / "manifest.xlsx"))
+
+    def test_empty_rows_keep_header(self):
+        header = [name for name in read_excel_header(self.dataset_dir / "subjects.xlsx") if name is not None]
+
+        self.dataset.write_rows("subjects", iter(list()), self.dataset_dir)
+
+        self.assertEqual(read_excel_header(self.dataset_dir / "subjects.xlsx"), header)
+        self.assertEqual(list(self.dataset.iter_rows("subjects")), list())
+
+    def test_template_style(self):
+        # a version which is not normalised yet, e.g. set by the constructor
+        self.dataset._version = "2.0.0"
+        template_path = self.dataset._get_template_dir("2_0_0") / "subjects.xlsx"
+
+        self.dataset.write_rows("subjects", [{"subject id": "sub-1", "species": "human"}], self.dataset_dir)
+
+        template = load_workbook(str(template_path)).worksheets[0]
+        workbook = load_workbook(str(self.dataset_dir / "subjects.xlsx")).worksheets[0]
+        self.assertEqual(workbook["A1"].value, "subject id")
+        self.assertEqual(workbook["A1"].font.b, template["A1"].font.b)
+        self.assertEqual(workbook.column_dimensions["A"].width, template.column_dimensions["A"].width)
+
+
+if __name__ == '__main__':
+    unittest.main()